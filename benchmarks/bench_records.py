@@ -0,0 +1,65 @@
+"""Compares the memory held by DataComplexType and RecordType records.
+
+    python benchmarks/bench_records.py [count]
+
+Records are created as an export would, then kept in memory; the bytes per record
+are the ones allocated by python (tracemalloc), the time the one of their creation.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysxm.ext import DataComplexType, RecordType, XDateType, XSimpleType  # noqa: E402
+
+
+def _is_country(value, countries):
+    return value in countries
+
+
+class User(DataComplexType):
+    nsmap = {'u': 'http://users/'}
+    _sequence = ('username', 'first_name', 'last_name', 'country', 'birth_date')
+    country = XSimpleType('country', ['fr', 'us', 'ci'], _is_country)
+    birth_date = XDateType('birth_date')
+
+
+class UserRecord(RecordType):
+    nsmap = {'u': 'http://users/'}
+    _sequence = ('username', 'first_name', 'last_name', 'country', 'birth_date')
+    country = XSimpleType('country', ['fr', 'us', 'ci'], _is_country)
+    birth_date = XDateType('birth_date')
+
+
+def rows(count):
+    for index in range(count):
+        yield dict(username='user-%d' % index, first_name='token', last_name='black',
+                   country=('fr', 'us', 'ci')[index % 3], birth_date='2000-01-%02d' % (index % 28 + 1))
+
+
+def bench(klass, count):
+    data = list(rows(count))
+    tracemalloc.start()
+    start = time.time()
+    records = [klass(**row) for row in data]
+    elapsed = time.time() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('  %-16s %8.1f bytes/record %8.3f us/record' % (
+        klass.__name__, float(size) / count, elapsed * 1e6 / count))
+    return records
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('%d records' % count)
+    bench(User, count)
+    bench(UserRecord, count)
+
+
+if __name__ == '__main__':
+    main()
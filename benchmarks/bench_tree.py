@@ -0,0 +1,59 @@
+"""Measures how the serialization of deep and wide trees scales.
+
+    python benchmarks/bench_tree.py
+
+The time per node should stay flat as the trees grow.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysxm import ComplexType  # noqa: E402
+
+
+class Node(ComplexType):
+    _sequence = ('name', 'value', 'node')
+
+    def __init__(self, depth):
+        self.name = 'node-%d' % depth
+        self.value = depth
+        if depth:
+            self.node = Node(depth - 1)
+
+
+class Item(ComplexType):
+
+    def __init__(self, index):
+        self.sku = 'sku-%d' % index
+        self.quantity = index
+
+
+class Order(ComplexType):
+
+    def __init__(self, size):
+        self.reference = 'order'
+        self.items = [Item(i) for i in range(size)]
+
+
+def bench(label, factory, sizes, nodes_per_unit):
+    print(label)
+    for size in sizes:
+        obj = factory(size)
+        number = max(1, 2000 // size)
+        elapsed = min(timeit.repeat(lambda: obj.xml, number=number, repeat=3)) / number
+        nodes = size * nodes_per_unit
+        print('  size=%-6d %10.3f ms %8.3f us/node' % (size, elapsed * 1e3, elapsed * 1e6 / nodes))
+
+
+def main():
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    bench('deep tree (depth)', Node, (25, 50, 100, 200, 400), 3)
+    bench('wide tree (list length)', Order, (250, 500, 1000, 2000, 4000), 3)
+
+
+if __name__ == '__main__':
+    main()
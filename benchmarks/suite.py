@@ -0,0 +1,267 @@
+"""Benchmarks of the marshalling hot paths on synthetic fixtures.
+
+    python benchmarks/suite.py                          # run and report
+    python benchmarks/suite.py --save baseline.json     # store the results as a baseline
+    python benchmarks/suite.py --compare baseline.json  # fail on regressions against a baseline
+
+Each case reports the time of one operation, its throughput and latency per element
+(or per record for the cases building objects) and the peak memory it allocates.
+Timings depend on the machine: compare against a baseline saved on the same one.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import datetime
+import io
+import json
+import os
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysxm import ComplexType, SimpleType  # noqa: E402
+from pysxm.ext import (DataComplexType, DateTimeType, DateType, Restriction, XDateTimeType,  # noqa: E402
+                       XDateType, XSimpleType)
+from pysxm.pysxm import ElementFactory  # noqa: E402
+from pysxm.stream import is_clean, write  # noqa: E402
+
+
+class Wide(ComplexType):
+
+    def __init__(self, size):
+        for index in range(size):
+            setattr(self, 'field%d' % index, 'value %d' % index)
+
+
+class Deep(ComplexType):
+    _sequence = ('name', 'value', 'deep')
+
+    def __init__(self, depth):
+        self.name = 'node-%d' % depth
+        self.value = depth
+        if depth:
+            self.deep = Deep(depth - 1)
+
+
+class Nested(ComplexType):
+    # the child comes first: the element is only known to be clean once the leaf is reached
+    _sequence = ('nested', 'name')
+
+    def __init__(self, depth):
+        if depth:
+            self.nested = Nested(depth - 1)
+        else:
+            self.name = 'leaf'
+
+
+class Item(ComplexType):
+    _sequence = ('sku', 'quantity', 'price')
+
+    def __init__(self, index):
+        self.sku = 'sku-%d' % index
+        self.quantity = index
+        self.price = index * 1.5
+
+
+class Order(ComplexType):
+
+    def __init__(self, size):
+        self.reference = 'order'
+        self.items = [Item(index) for index in range(size)]
+
+
+class Code(SimpleType):
+    nsmap = {'c': 'http://codes/'}
+
+    def check_restriction(self, value):
+        pass
+
+
+class Party(ComplexType):
+    nsmap = {'p': 'http://parties/', 'c': 'http://codes/'}
+    attrib = {'{http://codes/}scheme': 'iso'}
+
+    def __init__(self, index):
+        self.name = 'party %d' % index
+        self.code = Code('P%d' % index)
+
+
+class Invoice(ComplexType):
+    nsmap = {'i': 'http://invoices/'}
+
+    def __init__(self, size):
+        self.number = 'F-1'
+        self.parties = [Party(index) for index in range(size)]
+
+
+COUNTRIES = ['C%03d' % index for index in range(300)]
+
+
+class Customer(DataComplexType):
+    _sequence = ('name', 'country', 'segment', 'status')
+    country = XSimpleType('country', Restriction(enumeration=COUNTRIES))
+    segment = XSimpleType('segment', ['retail', 'corporate'], lambda v, av: v in av)
+    status = XSimpleType('status', Restriction(pattern='[a-z]+', max_length=8))
+
+
+class Event(DataComplexType):
+    _sequence = ('name', 'day', 'at')
+    day = XDateType('day')
+    at = XDateTimeType('at')
+
+
+class Records(ComplexType):
+
+    def __init__(self, records):
+        self.records = records
+
+
+def customers(size):
+    return [Customer(name='customer %d' % index, country=COUNTRIES[index % 300],
+                     segment=('retail', 'corporate')[index % 2], status='active')
+            for index in range(size)]
+
+
+def events(size):
+    return [Event(name='event %d' % index, day='2018-03-%02d' % (index % 28 + 1),
+                  at=datetime.datetime(2018, 3, index % 28 + 1, index % 24, 30))
+            for index in range(size)]
+
+
+def dates(size):
+    return [(DateType('2018-03-%02dT10:00:00' % (index % 28 + 1)), DateTimeType('2018-03-21T10:%02d' % (index % 60)))
+            for index in range(size)]
+
+
+def elements(obj):
+    return sum(1 for _ in obj.xml.iter())
+
+
+def _stream(obj):
+    write(obj, io.BytesIO())
+
+
+def _make_elements(count):
+    factory = ElementFactory.get(nsmap={'m': 'http://make/'})
+    for index in range(count):
+        factory.element('element', index)
+
+
+def cases():
+    """Yields (name, operation, units, unit name) of each benchmark, building its fixture
+    """
+    wide = Wide(500)
+    yield 'xml wide flat record', lambda: wide.xml, elements(wide), 'element'
+    deep = Deep(300)
+    yield 'xml deep nesting', lambda: deep.xml, elements(deep), 'element'
+    order = Order(3000)
+    yield 'xml large list', lambda: order.xml, elements(order), 'element'
+    invoice = Invoice(1000)
+    yield 'xml namespaced tree', lambda: invoice.xml, elements(invoice), 'element'
+    records = Records(customers(1000))
+    yield 'xml descriptor records', lambda: records.xml, elements(records), 'element'
+    yield 'stream large list', lambda: _stream(order), elements(order), 'element'
+    yield 'stream namespaced tree', lambda: _stream(invoice), elements(invoice), 'element'
+    # walks down to the leaf
+    nested = Nested(300)
+    yield 'is_clean deep nesting', lambda: is_clean(nested), elements(nested), 'element'
+    yield 'make_element', lambda: _make_elements(5000), 5000, 'element'
+    yield 'build descriptor records', lambda: customers(1000), 1000, 'record'
+    yield 'build date records', lambda: events(1000), 1000, 'record'
+    yield 'date types', lambda: dates(1000), 2000, 'value'
+
+
+def measure(operation, repeat):
+    number, elapsed = 1, 0
+    # enough runs for a measurable time
+    while True:
+        elapsed = min(timeit.repeat(operation, number=number, repeat=repeat)) / number
+        if elapsed * number > 0.1 or number >= 1000:
+            break
+        number *= 2
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(repeat=5, selected=None):
+    results = {}
+    for name, operation, units, unit in cases():
+        if selected and not any(word in name for word in selected):
+            continue
+        elapsed, peak = measure(operation, repeat)
+        results[name] = dict(ms=elapsed * 1e3, units=units, unit=unit, per_second=units / elapsed,
+                             us_per_unit=elapsed * 1e6 / units, peak_kb=peak / 1024 if peak is not None else None)
+        report(name, results[name])
+    return results
+
+
+def report(name, result, baseline=None):
+    line = '%-26s %9.3f ms %12.0f %s/s %8.3f us/%-7s' % (
+        name, result['ms'], result['per_second'], result['unit'], result['us_per_unit'], result['unit'])
+    if result['peak_kb'] is not None:
+        line += ' %9.1f KB peak' % result['peak_kb']
+    if baseline is not None:
+        line += '  x%.2f time' % (result['us_per_unit'] / baseline['us_per_unit'])
+        if result['peak_kb'] is not None and baseline.get('peak_kb'):
+            line += ' x%.2f memory' % (result['peak_kb'] / baseline['peak_kb'])
+    print(line)
+
+
+def compare(results, baseline, threshold):
+    """Prints the ratios of <results> to <baseline> and returns the names of the cases
+    which are slower or allocate more than <threshold> times the baseline
+    """
+    print('\ncompared to the baseline (%s)' % baseline.get('date', 'unknown date'))
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print('%-26s not in the baseline' % name)
+            continue
+        report(name, result, reference)
+        if result['us_per_unit'] > reference['us_per_unit'] * threshold:
+            regressions.append(name)
+        elif result['peak_kb'] and reference.get('peak_kb') and result['peak_kb'] > reference['peak_kb'] * threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', help='run the cases whose name contains one of these words')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each measure, the best one is kept')
+    parser.add_argument('--save', metavar='BASELINE', help='store the results into this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare the results with this file')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='ratio to the baseline above which a case is a regression (default: 1.5)')
+    args = parser.parse_args(argv)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+    results = run(args.repeat, args.cases)
+    if args.save:
+        with io.open(args.save, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(dict(date=datetime.date.today().isoformat(), python=sys.version.split()[0],
+                                     results=results), indent=2, sort_keys=True))
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nregressions: %s' % ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
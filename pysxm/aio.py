@@ -0,0 +1,180 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Asynchronous streaming of documents and records, python 3.5+ only.
+
+The synchronous writers of pysxm.stream are run by an executor and hand their
+output over to the event loop by chunks, through a bounded queue: the writer
+waits while <max_pending> chunks aren't consumed yet
+"""
+from __future__ import unicode_literals, absolute_import
+
+import asyncio
+import functools
+import io
+
+from pysxm.stream import write, write_records
+from pysxm.validation import context as validation_context
+
+# end of the stream, put after the last chunk
+_END = object()
+
+
+class _Closed(Exception):
+    """Raised in the executor when the consumer closed the stream
+    """
+
+
+class _Failure(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+class _Chunks(object):
+    """Target of a synchronous writer run by the executor, gathering its output
+    into chunks of about <buffer_size> bytes queued to the event loop
+    """
+
+    def __init__(self, loop, queue, buffer_size):
+        self.loop = loop
+        self.queue = queue
+        self.buffer_size = buffer_size
+        self.pending, self.pending_size = [], 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise _Closed()
+        self.pending.append(bytes(data))
+        self.pending_size += len(data)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            chunk = b''.join(self.pending)
+            self.pending, self.pending_size = [], 0
+            self.put(chunk)
+
+    def put(self, item):
+        if self.closed:
+            raise _Closed()
+        # blocks while the queue is full
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+
+def _produce(chunks, writer, report):
+    # the validation context of the consumer applies to the records built here
+    previous, validation_context.report = validation_context.report, report
+    try:
+        writer(chunks)
+        chunks.flush()
+        chunks.put(_END)
+    except _Closed:
+        pass
+    except BaseException as error:
+        try:
+            chunks.put(_Failure(error))
+        except _Closed:
+            pass
+    finally:
+        validation_context.report = previous
+
+
+class AsyncStream(object):
+    """Asynchronous iterator over the chunks of bytes written by <writer>, a callable writing
+    into the target it's given. <writer> is run by <executor>, the default one of the loop
+    if None, once the first chunk is awaited. The stream is closed by <aclose>, when
+    the consumer stops before its end
+    """
+
+    def __init__(self, writer, buffer_size=io.DEFAULT_BUFFER_SIZE, max_pending=4, executor=None):
+        self.writer = writer
+        self.buffer_size = buffer_size
+        self.max_pending = max_pending
+        self.executor = executor
+        self.report = validation_context.report
+        self.chunks = self.future = None
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    def _start(self):
+        loop = asyncio.get_event_loop()
+        self.chunks = _Chunks(loop, asyncio.Queue(self.max_pending), self.buffer_size)
+        self.future = loop.run_in_executor(self.executor, _produce, self.chunks, self.writer, self.report)
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        if self.chunks is None:
+            self._start()
+        item = await self.chunks.queue.get()
+        if isinstance(item, bytes):
+            return item
+        self.done = True
+        await self.future
+        if item is not _END:
+            raise item.error
+        raise StopAsyncIteration
+
+    def close(self):
+        """Stops the writer, which fails on its next write
+        """
+        self.done = True
+        chunks = self.chunks
+        if chunks is None or chunks.closed:
+            return
+        chunks.closed = True
+        # unblocks a pending put
+        while not chunks.queue.empty():
+            chunks.queue.get_nowait()
+
+    async def aclose(self):
+        self.close()
+        if self.future is not None:
+            await self.future
+
+    def __del__(self):
+        self.close()
+
+
+def stream(obj, compression=0, buffer_size=io.DEFAULT_BUFFER_SIZE, max_pending=4, executor=None):
+    """Returns an AsyncStream of the xml of <obj>, the output of pysxm.stream.write, e.g:
+
+        async for chunk in stream(catalog):
+            await response.write(chunk)
+    """
+    return AsyncStream(functools.partial(write, obj, compression=compression), buffer_size, max_pending, executor)
+
+
+def stream_records(records, tag, nsmap=None, attrib=None, compression=0, chunk_size=1000,
+                   buffer_size=io.DEFAULT_BUFFER_SIZE, workers=0, max_pending=4, executor=None):
+    """Returns an AsyncStream of the output of pysxm.stream.write_records.
+    <records> are consumed by the executor
+    """
+    # the chunks are given as the target
+    writer = functools.partial(write_records, records, tag=tag, nsmap=nsmap, attrib=attrib,
+                               compression=compression, chunk_size=chunk_size, buffer_size=0, workers=workers)
+    return AsyncStream(writer, buffer_size, max_pending, executor)
+
+
+__all__ = ['AsyncStream', 'stream', 'stream_records']
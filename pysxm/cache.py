@@ -0,0 +1,196 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import weakref
+from collections import OrderedDict
+
+from pysxm.pysxm import LIST, NODE, BaseType, SerializationPlan, value_handler
+
+
+class SerializationCache(object):
+    """Bounded cache of the elements built for CachedType objects.
+    Up to <max_entries> subtrees are kept, the least recently used being evicted first.
+    Entries are looked up by object identity and dropped when the object changes or is collected
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        # reentrant, objects may be collected while it's held
+        self.lock = threading.RLock()
+
+    def get(self, obj):
+        """Returns the (element, clean) entry of <obj>, None if it isn't cached
+        """
+        key = id(obj)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            # an object collected may have left its id to a new one
+            if entry is None or entry[0]() is not obj:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+        return entry[1:]
+
+    def put(self, obj, element, clean):
+        key = id(obj)
+        with self.lock:
+            self.entries[key] = (weakref.ref(obj, lambda ref: self._collected(key, ref)), element, clean)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def _collected(self, key, ref):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is ref:
+                del self.entries[key]
+
+    def discard(self, obj):
+        with self.lock:
+            entry = self.entries.get(id(obj))
+            if entry is not None and entry[0]() is obj:
+                del self.entries[id(obj)]
+
+    def clear(self):
+        """Drops all the entries, needed when a class the cached objects rely on is changed
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return dict(entries=len(self.entries), max_entries=self.max_entries, hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+
+def _rebinds(scope, bindings):
+    """Tells whether one of the (prefix, namespace) <bindings> binds a prefix of <scope> to another namespace
+    """
+    return any(scope.get(prefix, href) != href for prefix, href in bindings)
+
+
+# cache of the CachedType classes which don't define their own
+cache = SerializationCache()
+
+# objects of the cached elements which contain a given object: {child: set of parents}
+_parents = weakref.WeakKeyDictionary()
+
+# namespaces bound in the element of a CachedType object, see CachedType._track_children
+_bindings = weakref.WeakKeyDictionary()
+
+# lock of <_parents> and <_bindings>, reentrant as the one of SerializationCache
+_lock = threading.RLock()
+
+
+class CachedType(object):
+    """Mixin caching the element of a BaseType object, e.g: class Catalog(CachedType, ComplexType).
+    Serializing the object again copies the cached element instead of building it.
+    Setting an attribute, descriptor fields included, drops the element of the object and
+    the ones of the cached objects containing it, so that only the path to the root is built again.
+    Lists changed in place, or objects which aren't CachedType changed, aren't seen:
+    <invalidate> has then to be called
+    """
+    serialization_cache = cache
+
+    def __setattr__(self, name, value):
+        super(CachedType, self).__setattr__(name, value)
+        self.invalidate()
+
+    def invalidate(self):
+        """Drops the cached element of the object and of the objects containing it
+        """
+        self.serialization_cache.discard(self)
+        with _lock:
+            parents = list(_parents.get(self, ()))
+        for parent in parents:
+            parent.invalidate()
+
+    def _build(self, parent=None, parent_factory=None):
+        entry = self.serialization_cache.get(self)
+        if entry is not None:
+            element, clean = entry
+            element = element.__deepcopy__(None)
+        else:
+            # built on its own, lxml merges its namespaces once appended as for any detached element
+            element, clean = super(CachedType, self)._build()
+            if self._track_children() is not None:
+                self.serialization_cache.put(self, element.__deepcopy__(None), clean)
+        if parent is not None:
+            parent.append(element)
+        return element, clean
+
+    def _track_children(self):
+        """Records the object as the parent of the nearest CachedType objects it contains.
+        Returns the (prefix, namespace) bindings of its element, None when a prefix is bound
+        again to another namespace below it: lxml may then leave an element bound to the
+        shadowed declaration, which a copy doesn't keep, so the element can't be cached.
+        Namespaces of attributes missing from the namespace map get generated prefixes
+        and are taken as such a binding
+        """
+        bindings = set()
+        objects = [(self, {})]
+        while objects:
+            obj, scope = objects.pop()
+            plan = SerializationPlan.get(obj.__class__)
+            nsmap = plan.factory_of(obj).nsmap
+            if nsmap and bindings is not None:
+                if _rebinds(scope, nsmap.items()):
+                    bindings = None
+                elif any(prefix not in scope for prefix in nsmap):
+                    bindings.update(nsmap.items())
+                    scope = dict(scope)
+                    scope.update(nsmap)
+            if obj.attrib and bindings is not None:
+                prefixed = set(href for prefix, href in (nsmap or {}).items() if prefix is not None)
+                if any(key[:1] == '{' and key[1:key.index('}')] not in prefixed for key in obj.attrib):
+                    bindings = None
+            if not plan.complex:
+                continue
+            for name, tag, kind in plan.fields(obj):
+                if kind is not None and kind is not NODE and kind is not LIST:
+                    continue
+                value = getattr(obj, name, None)
+                if kind is None and value is not None:
+                    kind = value_handler(value)[0]
+                for member in (value if kind is LIST else (value,)):
+                    if isinstance(member, CachedType):
+                        with _lock:
+                            _parents.setdefault(member, weakref.WeakSet()).add(self)
+                            # built before the object, its bindings are known
+                            member_bindings = _bindings.get(member)
+                        if member_bindings is None or bindings is None or _rebinds(scope, member_bindings):
+                            bindings = None
+                        else:
+                            bindings.update(member_bindings)
+                    elif isinstance(member, BaseType):
+                        # its changes aren't seen, but the ones of its children are
+                        objects.append((member, scope))
+        if bindings is not None:
+            bindings = frozenset(bindings)
+        with _lock:
+            _bindings[self] = bindings
+        return bindings
+
+
+__all__ = ['CachedType', 'SerializationCache', 'cache']
@@ -0,0 +1,604 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Generates the pysxm classes of an XML schema, e.g:
+
+    python -m pysxm.codegen partner.xsd -o partner.py
+
+Complex types become DataComplexType classes with their tag, namespace map and sequence.
+Restricted simple types become Restriction objects, compiled once when the module is imported,
+checked by XSimpleType descriptors. Repeated elements are lists, written by pysxm inside
+an element of the field name: an element whose type only holds a repeated element is
+generated as a list field. What pysxm can't express is reported by comments in the module
+"""
+from __future__ import unicode_literals, absolute_import
+
+import argparse
+import io
+import keyword
+import re
+import sys
+from collections import OrderedDict
+
+from lxml import etree
+
+from pysxm.ext import DataComplexType
+from pysxm.pysxm import string_types
+
+XS = 'http://www.w3.org/2001/XMLSchema'
+
+# implicit bounds of the builtin integer types
+_integers = {
+    'integer': {}, 'nonNegativeInteger': dict(min_inclusive=0), 'positiveInteger': dict(min_inclusive=1),
+    'nonPositiveInteger': dict(max_inclusive=0), 'negativeInteger': dict(max_inclusive=-1),
+    'long': dict(min_inclusive=-2 ** 63, max_inclusive=2 ** 63 - 1),
+    'int': dict(min_inclusive=-2 ** 31, max_inclusive=2 ** 31 - 1),
+    'short': dict(min_inclusive=-2 ** 15, max_inclusive=2 ** 15 - 1),
+    'byte': dict(min_inclusive=-2 ** 7, max_inclusive=2 ** 7 - 1),
+    'unsignedLong': dict(min_inclusive=0, max_inclusive=2 ** 64 - 1),
+    'unsignedInt': dict(min_inclusive=0, max_inclusive=2 ** 32 - 1),
+    'unsignedShort': dict(min_inclusive=0, max_inclusive=2 ** 16 - 1),
+    'unsignedByte': dict(min_inclusive=0, max_inclusive=2 ** 8 - 1),
+}
+# converters of the numeric builtin types
+_converters = dict(decimal='Decimal', float='float', double='float')
+_converters.update((name, 'int') for name in _integers)
+# descriptors of the date builtin types
+_dates = {'date': 'XDateType', 'dateTime': 'XDateTimeType', 'time': 'XTimeType'}
+# facets checked by Restriction, the others are ignored
+_facets = {'minInclusive': 'min_inclusive', 'maxInclusive': 'max_inclusive', 'minExclusive': 'min_exclusive',
+           'maxExclusive': 'max_exclusive', 'length': 'length', 'minLength': 'min_length',
+           'maxLength': 'max_length'}
+_bounds = ('min_inclusive', 'max_inclusive', 'min_exclusive', 'max_exclusive')
+
+# attributes of the data classes a field can't be named after
+_reserved = frozenset(dir(DataComplexType))
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _xs(name):
+    return '{%s}%s' % (XS, name)
+
+
+def _max_occurs(node):
+    occurs = node.get('maxOccurs', '1')
+    return occurs == 'unbounded' or int(occurs) > 1
+
+
+def _class_name(name):
+    name = ''.join(part[:1].upper() + part[1:] for part in re.split(r'[^0-9A-Za-z]+', name) if part)
+    return name if name[:1].isalpha() else 'T' + name
+
+
+def _constant_name(name):
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name)
+    name = re.sub(r'[^0-9A-Za-z]+', '_', name).strip('_').upper()
+    return name if name[:1].isalpha() else 'R_' + name
+
+
+def _identifier(name):
+    """Returns <name> if a field can be named after it, a python identifier otherwise
+    """
+    if re.match(r'^[A-Za-z_][0-9A-Za-z_]*$', name) and not keyword.iskeyword(name) and name not in _reserved:
+        return name
+    name = re.sub(r'[^0-9A-Za-z_]', '_', name)
+    if not name[:1].isalpha():
+        name = 'f_' + name
+    return name + '_'
+
+
+def _literal(value):
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return '(%s%s)' % (', '.join(_literal(item) for item in value), ',' if len(value) == 1 else '')
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, _Decimal):
+        return "Decimal('%s')" % value.text
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n')
+
+
+class _Decimal(object):
+    # a decimal literal of the generated code
+    def __init__(self, text):
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, _Decimal) and other.text == self.text
+
+    def __hash__(self):
+        return hash(self.text)
+
+
+def _convert(text, converter):
+    if converter == 'int':
+        return int(text)
+    if converter == 'float':
+        return float(text)
+    if converter == 'Decimal':
+        return _Decimal(text)
+    return text
+
+
+class _Simple(object):
+    """A simple type: its builtin base and the facets of its restrictions
+    """
+
+    def __init__(self, builtin, facets=None, notes=(), name=None):
+        self.builtin = builtin
+        self.facets = OrderedDict(facets or ())
+        self.notes = list(notes)
+        self.name = name
+
+    @property
+    def converter(self):
+        return _converters.get(self.builtin)
+
+    def restriction(self):
+        """Returns the arguments of its Restriction, implicit bounds included
+        """
+        arguments = OrderedDict(_integers.get(self.builtin, ()))
+        arguments.update(self.facets)
+        converter = self.converter
+        if 'enumeration' in arguments and converter is not None:
+            # values are given as numbers or read as text
+            values = arguments['enumeration']
+            arguments['enumeration'] = tuple(values) + tuple(_convert(value, converter) for value in values)
+        if converter is not None and any(bound in arguments for bound in _bounds):
+            arguments['converter'] = converter
+        return arguments
+
+
+class _Field(object):
+
+    def __init__(self, name, attr=None):
+        self.name = name
+        self.attr = attr or name
+        # descriptor code, None for a plain field
+        self.descriptor = None
+        # entry of the _types of the class, as code
+        self.type = None
+
+
+class _Class(object):
+
+    def __init__(self, name, base, tagname=None, nsmap=False):
+        self.name = name
+        self.base = base
+        self.tagname = tagname
+        self.nsmap = nsmap
+        self.fields = []
+        # the whole sequence, inherited fields included
+        self.sequence = []
+        self.attrib = OrderedDict()
+        self.restriction = None
+        self.notes = []
+
+
+class Generator(object):
+    """Reads the schema <tree> and generates the module of its classes
+    """
+
+    def __init__(self, tree, source=None):
+        self.root = root = tree.getroot() if hasattr(tree, 'getroot') else tree
+        if root.tag != _xs('schema'):
+            raise SchemaError('%s is not an XML schema' % (source or root.tag))
+        self.source = source
+        self.namespace = root.get('targetNamespace')
+        # local elements are in the target namespace
+        self.qualified = not self.namespace or root.get('elementFormDefault') == 'qualified'
+        prefixes = [prefix for prefix, href in root.nsmap.items() if prefix and href == self.namespace]
+        self.nsmap = {(prefixes[0] if prefixes else 'tns'): self.namespace} if self.namespace else None
+        self.simple_types, self.complex_types, self.elements, self.groups = {}, {}, OrderedDict(), {}
+        for node in root:
+            name = node.get('name')
+            if node.tag == _xs('simpleType'):
+                self.simple_types[name] = node
+            elif node.tag == _xs('complexType'):
+                self.complex_types[name] = node
+            elif node.tag == _xs('element'):
+                self.elements[name] = node
+            elif node.tag == _xs('group'):
+                self.groups[name] = node
+            elif node.tag in (_xs('include'), _xs('import'), _xs('redefine')):
+                raise SchemaError('%s <%s> is not supported, generate a single schema' % (
+                    etree.QName(node).localname, node.get('schemaLocation')))
+        self.classes = OrderedDict()
+        self.restrictions = OrderedDict()
+        self.type_classes, self.element_classes, self.simple_cache = {}, {}, {}
+
+    def generate(self):
+        for name, node in self.elements.items():
+            kind, value = self.type_of(node)
+            if kind == 'complex':
+                self.complex_class(value, name, top=True)
+            else:
+                self.simple_class(value, name, top=True)
+        for name, node in sorted(self.complex_types.items()):
+            self.named_type_class(name)
+        return self.render()
+
+    # types
+
+    def resolve(self, qname, node):
+        """Returns (namespace, local name) of the QName <qname> of <node>
+        """
+        prefix, _, local = qname.rpartition(':')
+        namespace = node.nsmap.get(prefix or None)
+        if prefix and namespace is None:
+            raise SchemaError('unknown prefix of %s' % qname)
+        return namespace, local
+
+    def type_of(self, node):
+        """Returns ('simple', _Simple) or ('complex', (complexType node, name)) of the element <node>
+        """
+        qname = node.get('type')
+        if qname is not None:
+            return self.named_type(qname, node)
+        simple, complex_ = node.find(_xs('simpleType')), node.find(_xs('complexType'))
+        if simple is not None:
+            return 'simple', self.simple_of(simple)
+        if complex_ is not None:
+            return self.complex_or_simple(complex_, None)
+        return 'simple', _Simple('string')
+
+    def named_type(self, qname, node):
+        namespace, local = self.resolve(qname, node)
+        if namespace == XS:
+            if local == 'anyType':
+                return 'simple', _Simple('string', notes=['%s: anyType is written as text' % node.get('name')])
+            return 'simple', _Simple(local)
+        if local in self.simple_types:
+            return 'simple', self.simple_of(self.simple_types[local], local)
+        if local in self.complex_types:
+            return self.complex_or_simple(self.complex_types[local], local)
+        raise SchemaError('unknown type %s' % qname)
+
+    def complex_or_simple(self, node, name):
+        content = node.find(_xs('simpleContent'))
+        if content is None:
+            return 'complex', (node, name)
+        # text with attributes, which pysxm can't vary per instance
+        derivation = content[0]
+        kind, simple = self.named_type(derivation.get('base'), derivation)
+        if kind != 'simple':
+            raise SchemaError('simple content of %s derives from a complex type' % name)
+        return 'simple', _Simple(simple.builtin, simple.facets, simple.notes + [
+            'attributes of the simple content of %s are left out' % (name or 'an element')])
+
+    def simple_of(self, node, name=None):
+        if name is not None and name in self.simple_cache:
+            return self.simple_cache[name]
+        restriction = node.find(_xs('restriction'))
+        if restriction is None:
+            # lists and unions are checked as text
+            simple = _Simple('string', notes=['%s: lists and unions are written as text' % (name or 'simple type')])
+        else:
+            if restriction.get('base') is not None:
+                kind, base = self.named_type(restriction.get('base'), restriction)
+            else:
+                base = self.simple_of(restriction.find(_xs('simpleType')))
+            simple = _Simple(base.builtin, base.facets, base.notes)
+            enumeration, patterns = [], []
+            for facet in restriction:
+                if not isinstance(facet.tag, string_types):
+                    continue
+                tag, value = etree.QName(facet).localname, facet.get('value')
+                if tag == 'enumeration':
+                    enumeration.append(value)
+                elif tag == 'pattern':
+                    patterns.append(value)
+                elif tag in _facets:
+                    converter = simple.converter if _facets[tag] in _bounds else 'int'
+                    if converter is None:
+                        simple.notes.append('%s: %s of a %s is not checked' % (
+                            name or 'simple type', tag, simple.builtin))
+                        continue
+                    simple.facets[_facets[tag]] = _convert(value, converter)
+            if enumeration:
+                simple.facets['enumeration'] = tuple(enumeration)
+            if patterns:
+                pattern = '|'.join(patterns) if len(patterns) > 1 else patterns[0]
+                try:
+                    re.compile(pattern)
+                except re.error:
+                    simple.notes.append('%s: pattern %s is not a python regular expression' % (
+                        name or 'simple type', pattern))
+                else:
+                    simple.facets['pattern'] = pattern
+        if name is not None:
+            simple.name = name
+            self.simple_cache[name] = simple
+        return simple
+
+    def particles(self, node, repeated=False):
+        """Yields the (element node, repeated) of the content model <node>
+        """
+        for child in node:
+            if child.tag == _xs('element'):
+                yield child, repeated or _max_occurs(child)
+            elif child.tag in (_xs('sequence'), _xs('choice'), _xs('all')):
+                for particle in self.particles(child, repeated or _max_occurs(child)):
+                    yield particle
+            elif child.tag == _xs('group'):
+                group = self.groups.get(self.resolve(child.get('ref'), child)[1])
+                if group is None:
+                    raise SchemaError('unknown group %s' % child.get('ref'))
+                for particle in self.particles(group, repeated or _max_occurs(child)):
+                    yield particle
+            elif child.tag == _xs('any'):
+                yield child, repeated
+
+    def element_of(self, node):
+        """Returns the declaration of the element <node>, a global one for references
+        """
+        if node.get('ref') is None:
+            return node
+        declaration = self.elements.get(self.resolve(node.get('ref'), node)[1])
+        if declaration is None:
+            raise SchemaError('unknown element %s' % node.get('ref'))
+        return declaration
+
+    # classes
+
+    def unique(self, name):
+        candidate, index = name, 2
+        while candidate in self.classes or candidate in self.restrictions.values():
+            candidate = '%s%d' % (name, index)
+            index += 1
+        return candidate
+
+    def named_type_class(self, name):
+        """Returns the class of the complex type <name>, tagged with its name
+        """
+        if name not in self.type_classes:
+            node = self.complex_types[name]
+            kind, value = self.complex_or_simple(node, name)
+            if kind != 'complex':
+                return None
+            self.build_class(node, self.unique(_class_name(name)), None, self.qualified, name)
+        return self.type_classes[name]
+
+    def complex_class(self, value, tagname, top=False):
+        """Returns the class of the elements <tagname> of the complex type <value>
+        """
+        node, name = value
+        nsmap = top or self.qualified
+        key = (name if name is not None else node, tagname, nsmap)
+        if key in self.element_classes:
+            return self.element_classes[key]
+        if name is None:
+            klass = self.build_class(node, self.unique(_class_name(tagname)), tagname, nsmap)
+        else:
+            base = self.named_type_class(name)
+            if base.tagname is None and base.name.lower() == tagname and base.nsmap == nsmap:
+                klass = base
+            else:
+                klass = _Class(self.unique(_class_name(tagname)), base.name, tagname, nsmap)
+                klass.sequence = list(base.sequence)
+                self.classes[klass.name] = klass
+        self.element_classes[key] = klass
+        return klass
+
+    def simple_class(self, simple, tagname, top=False):
+        """Returns the RestrictedSimpleType class of the elements <tagname> of <simple>
+        """
+        key = (id(simple), tagname, top)
+        if key not in self.element_classes:
+            klass = _Class(self.unique(_class_name(tagname)), 'RestrictedSimpleType', tagname, top or self.qualified)
+            klass.restriction = self.restriction_of(simple, tagname)
+            klass.notes.extend(simple.notes)
+            self.classes[klass.name] = klass
+            self.element_classes[key] = klass
+        return self.element_classes[key]
+
+    def build_class(self, node, name, tagname, nsmap, type_name=None):
+        """Returns the class of the complex type <node>, the one of the named type <type_name> if given
+        """
+        base, content = 'DataComplexType', node
+        complex_content = node.find(_xs('complexContent'))
+        klass = _Class(name, base, tagname, nsmap)
+        if complex_content is not None:
+            content = complex_content[0]
+            if content.tag == _xs('extension'):
+                kind, value = self.named_type(content.get('base'), content)
+                if kind == 'complex' and value[1] is not None:
+                    parent = self.named_type_class(value[1])
+                    klass.base = parent.name
+                    klass.sequence = list(parent.sequence)
+        # registered before its fields for recursive types
+        self.classes[name] = klass
+        if type_name is not None:
+            self.type_classes[type_name] = klass
+        attributes = []
+        for attribute in content.findall(_xs('attribute')):
+            name = attribute.get('name') or attribute.get('ref')
+            if attribute.get('fixed') is not None:
+                klass.attrib[name] = attribute.get('fixed')
+            else:
+                attributes.append('%s (required)' % name if attribute.get('use') == 'required' else name)
+        if attributes:
+            klass.notes.append('attributes set per instance through <attrib>: %s' % ', '.join(attributes))
+        for particle, repeated in self.particles(content):
+            if particle.tag == _xs('any'):
+                klass.notes.append('wildcard elements are left out')
+                continue
+            declaration = self.element_of(particle)
+            field = self.field(klass, declaration, repeated, declaration.getparent() is self.root)
+            klass.fields.append(field)
+            klass.sequence.append(field.attr)
+        return klass
+
+    def restriction_of(self, simple, name):
+        """Returns the constant of the Restriction of <simple>, shared by identical ones.
+        It's named after the type, or <name> for anonymous types
+        """
+        if simple.name is not None:
+            name = simple.name
+        elif not simple.facets:
+            name = simple.builtin
+        arguments = simple.restriction()
+        if not arguments:
+            return None
+        code = 'Restriction(%s)' % ', '.join(
+            '%s=%s' % (argument, value if argument == 'converter' else _literal(value))
+            for argument, value in arguments.items())
+        if code not in self.restrictions:
+            self.restrictions[code] = self.unique(_constant_name(name))
+        return self.restrictions[code]
+
+    def field(self, klass, node, repeated, top=False):
+        """Returns the field of the element <node>, a global element if <top>
+        """
+        name = node.get('name')
+        field = _Field(name, _identifier(name))
+        kind, value = self.type_of(node)
+        if kind == 'complex':
+            members = list(self.particles(value[0]))
+            if not repeated and len(members) == 1 and members[0][1] and members[0][0].tag == _xs('element'):
+                # the list wrapped by the element
+                member = self.element_of(members[0][0])
+                member_kind, member_value = self.type_of(member)
+                if member_kind == 'complex':
+                    member_class = self.complex_class(member_value, member.get('name'))
+                else:
+                    member_class = self.simple_class(member_value, member.get('name'))
+                if field.attr != name:
+                    klass.notes.append('list %s is written as %s' % (name, field.attr))
+                if not self.qualified:
+                    klass.notes.append('list %s is in the namespace of the class' % name)
+                field.type = '[%s]' % member_class.name
+                return field
+            field.type = self.complex_class(value, name, top).name
+        elif repeated:
+            field.type = self.simple_class(value, name, top).name
+        else:
+            self.simple_field(klass, field, value, top or self.qualified)
+        if repeated:
+            klass.notes.append('%s is repeated, pysxm writes lists inside an element <%s>' % (name, field.attr))
+            field.type = '[%s]' % field.type
+        return field
+
+    def simple_field(self, klass, field, simple, qualified):
+        klass.notes.extend(simple.notes)
+        options = ''
+        if field.attr != field.name:
+            options += ", tagname=%s" % _literal(field.name)
+        if qualified and self.nsmap:
+            options += ', nsmap=NSMAP'
+        # plain fields are in the namespace of the class
+        qualified = qualified and self.qualified
+        if simple.builtin in _dates and qualified and field.attr == field.name:
+            field.descriptor = '%s(%s)' % (_dates[simple.builtin], _literal(field.name))
+            return
+        arguments = simple.restriction()
+        if simple.builtin in _dates:
+            arguments = OrderedDict(pattern=_date_patterns[simple.builtin])
+            simple = _Simple('string', arguments)
+        if arguments or not qualified or field.attr != field.name:
+            constant = self.restriction_of(simple, '%s %s' % (klass.name, field.name)) or 'ANY'
+            field.descriptor = 'XSimpleType(%s, %s%s)' % (_literal(field.attr), constant, options)
+        elif simple.converter is not None:
+            field.type = simple.converter
+
+    # code
+
+    def render(self):
+        lines = ['# Generated by pysxm.codegen%s, do not edit' % (' from %s' % self.source if self.source else ''),
+                 'from __future__ import unicode_literals', '']
+        code = '\n'.join(self.render_class(klass) for klass in self.classes.values())
+        constants = '\n'.join('%s = %s' % (name, code) for code, name in self.restrictions.items())
+        types = ['%s._types = {%s}' % (klass.name, ', '.join(
+            '%s: %s' % (_literal(field.attr), field.type) for field in klass.fields if field.type))
+            for klass in self.classes.values() if any(field.type for field in klass.fields)]
+        if re.search(r'\bDecimal\b', constants + ''.join(types)):
+            lines.extend(['from decimal import Decimal', ''])
+        names = sorted(set(re.findall(r'\b(DataComplexType|RestrictedSimpleType|Restriction|XSimpleType|'
+                                      r'XDateTimeType|XDateType|XTimeType)\b', code + constants)) |
+                       set(['Restriction']))
+        lines.append('from pysxm.ext import %s' % ', '.join(names))
+        lines.append('')
+        lines.append('NSMAP = %r' % (self.nsmap,) if self.nsmap else 'NSMAP = None')
+        lines.append('')
+        if 'ANY' in code:
+            lines.append('ANY = Restriction()')
+        lines.append(constants)
+        lines.append('')
+        lines.append(code)
+        if types:
+            lines.append('')
+            lines.append('# classes of the fields, for unmarshalling')
+            lines.extend(types)
+            lines.append('')
+        return re.sub(r'\n{3,}', '\n\n\n', '\n'.join(lines)).strip('\n') + '\n'
+
+    def render_class(self, klass):
+        lines = ['', 'class %s(%s):' % (klass.name, klass.base)]
+        lines.extend('    # %s' % note for note in OrderedDict.fromkeys(klass.notes))
+        if klass.tagname is not None:
+            lines.append('    tagname = %s' % _literal(klass.tagname))
+        if klass.nsmap and self.nsmap:
+            lines.append('    nsmap = NSMAP')
+        if klass.attrib:
+            attrib = ', '.join('%s: %s' % (_literal(name), _literal(value)) for name, value in klass.attrib.items())
+            lines.append('    attrib = {%s}' % attrib)
+        if klass.restriction is not None:
+            lines.append('    restriction = %s' % klass.restriction)
+        if klass.base != 'RestrictedSimpleType' and (klass.fields or klass.base == 'DataComplexType'):
+            lines.append('    _sequence = %s' % _literal(tuple(klass.sequence)))
+        lines.extend('    %s = %s' % (field.attr, field.descriptor) for field in klass.fields if field.descriptor)
+        if len(lines) == 2:
+            lines.append('    pass')
+        return '\n'.join(lines) + '\n'
+
+
+# checks of the dates written as text
+_date_patterns = {
+    'date': r'\d{4}-\d{2}-\d{2}(Z|[+-]\d{2}:\d{2})?',
+    'dateTime': r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?',
+    'time': r'\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?',
+}
+
+
+def generate(source):
+    """Returns the code of the module of the classes of the schema <source>, a path or a file object
+    """
+    name = source if not hasattr(source, 'read') else getattr(source, 'name', None)
+    return Generator(etree.parse(source), name).generate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates the pysxm classes of an XML schema')
+    parser.add_argument('schema', help='path of the schema')
+    parser.add_argument('-o', '--output', help='path of the module, written to stdout by default')
+    args = parser.parse_args(argv)
+    code = generate(args.schema)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(code)
+    else:
+        sys.stdout.write(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,18 +19,206 @@
 # SOFTWARE.
 from __future__ import unicode_literals, absolute_import
 
+import datetime
+import functools
+import operator
+import re
+import threading
+from collections import OrderedDict
+
 from dateutil.parser import parse as dateutil_parse
+from dateutil.tz import tzoffset, tzutc
 
 from pysxm import BaseType, ComplexType, SimpleType
+from pysxm.pysxm import NODE, TEXT, ElementFactory, build_simple, string_types, text_type
+from pysxm.instrument import DATES, VALIDATION, context as instrumentation, timer
+from pysxm.validation import OFF, context as validation_context
+
+_iso_datetime = re.compile(r'^(\d{4})-(\d{2})-(\d{2})'
+                           r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?'
+                           r'(Z|[+-]\d{2}(?::?\d{2})?)?)?$')
+_iso_time = re.compile(r'^(\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?$')
+
+
+def _tzinfo(designator):
+    if designator is None:
+        return None
+    if designator == 'Z':
+        return tzutc()
+    digits = designator[1:].replace(':', '')
+    offset = int(digits[:2]) * 3600 + int(digits[2:] or 0) * 60
+    if not offset:
+        return tzutc()
+    return tzoffset(None, offset if designator[0] == '+' else -offset)
+
+
+def _microsecond(fraction):
+    return int(fraction.ljust(6, '0')) if fraction else 0
+
+
+class DateParser(object):
+    """Turns date and time values into isoformat strings, or the one of their <part> ('date' or 'time').
+    datetime, date and time objects are used as they are, ISO 8601 strings are read by a
+    precompiled regex and dateutil is the fallback for the others, unless <strict>.
+    With a <cache_size>, the results of the most recently used strings are kept,
+    the cache being shared by threads
+    """
+
+    def __init__(self, strict=False, cache_size=0):
+        self.strict = strict
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def isoformat(self, value, part=None):
+        if not isinstance(value, string_types):
+            return self.native(value, part)
+        if not self.cache_size:
+            return self.parse(value, part)
+        key = (value, part)
+        with self.lock:
+            result = self.cache.pop(key, None)
+            if result is not None:
+                self.cache[key] = result
+                return result
+        # parsed without the lock, a value may be parsed by several threads at once
+        result = self.parse(value, part)
+        with self.lock:
+            if key not in self.cache and len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+            self.cache[key] = result
+        return result
+
+    def native(self, value, part):
+        if isinstance(value, datetime.datetime):
+            pass
+        elif isinstance(value, datetime.date):
+            value = datetime.datetime(value.year, value.month, value.day)
+        elif isinstance(value, datetime.time):
+            if part == 'time':
+                return value.replace(tzinfo=None).isoformat()
+            # a time is given the date of today, as dateutil does
+            value = datetime.datetime.combine(datetime.date.today(), value)
+        else:
+            raise TypeError('%r is not a date, a time or a string' % (value,))
+        return getattr(value, part)().isoformat() if part else value.isoformat()
+
+    def parse(self, value, part):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        try:
+            parsed = self.parse_iso(value, part)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            if self.strict:
+                raise ValueError('%s is not an ISO 8601 date' % value)
+            parsed = dateutil_parse(value)
+        elif isinstance(parsed, datetime.time):
+            return parsed.isoformat()
+        return getattr(parsed, part)().isoformat() if part else parsed.isoformat()
+
+    def parse_iso(self, value, part):
+        match = _iso_datetime.match(value)
+        if match is not None:
+            year, month, day, hour, minute, second, fraction, designator = match.groups()
+            return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+                                     int(second or 0), _microsecond(fraction), _tzinfo(designator))
+        match = _iso_time.match(value) if part == 'time' else None
+        if match is not None:
+            hour, minute, second, fraction = match.groups()
+            return datetime.time(int(hour), int(minute), int(second or 0), _microsecond(fraction))
+        return None
+
+
+# parser of the date types, see <configure_dates>
+date_parser = DateParser()
+
+
+def configure_dates(strict=False, cache_size=0):
+    """Sets how the date types parse their values (see DateParser)
+    """
+    global date_parser
+    date_parser = DateParser(strict, cache_size)
+
+
+class InvalidDates(ValueError):
+    """Raised by <normalize_dates> once the whole column is read.
+    <errors> maps the indexes of the invalid values to their error,
+    <results> holds the normalized values, None for the invalid ones
+    """
+
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        details = ', '.join('%d: %s' % (index, errors[index]) for index in sorted(errors)[:5])
+        super(InvalidDates, self).__init__('%d invalid dates (%s%s)' % (
+            len(errors), details, ', ...' if len(errors) > 5 else ''))
+
+
+def normalize_dates(values, part=None):
+    """Returns the isoformat strings of a column of date <values>, or of their <part>.
+    Each distinct string is parsed once, numpy datetime64 arrays are converted at once.
+    Invalid values don't stop the normalization, they're all reported by InvalidDates
+    """
+    if getattr(getattr(values, 'dtype', None), 'kind', None) == 'M':
+        values = values.astype('datetime64[us]').tolist()
+    recorder = instrumentation.recorder
+    if recorder is not None:
+        start = timer()
+    isoformat = date_parser.isoformat
+    parsed, results, errors = {}, [], {}
+    for index, value in enumerate(values):
+        try:
+            # aware datetimes at different offsets may be equal, only strings are memoized
+            if not isinstance(value, string_types):
+                result = isoformat(value, part)
+            else:
+                result = parsed.get(value)
+                if result is None:
+                    result = parsed[value] = isoformat(value, part)
+        except (ValueError, TypeError, OverflowError) as error:
+            result = None
+            errors[index] = error
+        results.append(result)
+    if recorder is not None:
+        recorder.record(DATES, 'normalize_dates', timer() - start, len(results))
+    if errors:
+        raise InvalidDates(errors, results)
+    return results
 
 
 class GenericDateTime(BaseType):
+    # the part of the value kept by the class
+    part = None
 
     def __init__(self, value, part=None):
-        parsed_date = dateutil_parse(value)
-        self.value = parsed_date.isoformat()
-        if part:
-            self.value = getattr(parsed_date, part)().isoformat()
+        recorder = instrumentation.recorder
+        if recorder is None:
+            self.value = date_parser.isoformat(value, part)
+            return
+        start = timer()
+        self.value = date_parser.isoformat(value, part)
+        recorder.record(DATES, self.__class__.__name__, timer() - start, 1)
+
+    @classmethod
+    def from_column(cls, values):
+        """Returns the instances of a column of <values> normalized at once (see <normalize_dates>).
+        InvalidDates <results> are then instances too
+        """
+        try:
+            results = normalize_dates(values, cls.part)
+        except InvalidDates as error:
+            error.results = [cls._from_isoformat(result) if result is not None else None
+                             for result in error.results]
+            raise
+        return [cls._from_isoformat(result) for result in results]
+
+    @classmethod
+    def _from_isoformat(cls, value):
+        instance = cls.__new__(cls)
+        instance.value = value
+        return instance
 
 
 class DateTimeType(GenericDateTime):
@@ -40,31 +228,147 @@ class DateTimeType(GenericDateTime):
 
 
 class DateType(GenericDateTime):
+    part = 'date'
 
     def __init__(self, value):
-        super(DateType, self).__init__(value, 'date')
+        super(DateType, self).__init__(value, self.part)
 
 
 class TimeType(GenericDateTime):
+    part = 'time'
 
     def __init__(self, value):
-        super(TimeType, self).__init__(value, 'time')
+        super(TimeType, self).__init__(value, self.part)
 
 
 class NoRestrictionSimpleType(SimpleType):
 
         def __init__(self, value, tagname, nsmap=None, attrib=None):
-            super(NoRestrictionSimpleType, self).__init__(value)
+            # nothing to check, nor to record as a validation
+            self.value = value
             self._tagname = tagname
-            self.__class__.nsmap = nsmap if nsmap else {}
-            self.__class__.attrib = attrib if attrib else {}
+            # the namespace map and attributes belong to the instance, the class is shared
+            if nsmap:
+                self.nsmap = nsmap
+            if attrib:
+                self.attrib = attrib
 
         def check_restriction(self, value):
             pass
 
 
-class XSimpleType(object):
+class FieldSimpleType(NoRestrictionSimpleType):
+    """The value of the XSimpleType <field> of <instance>, as read from the field.
+    Its value is the one stored in <instance>: setting it stores the new value, unchecked
+    """
+
+    def __init__(self, field, instance):
+        self.field = field
+        self.instance = instance
+        self._tagname = field.tagname or field.name
+        if field.nsmap:
+            self.nsmap = field.nsmap
+        if field.attrib:
+            self.attrib = field.attrib
+
+    @property
+    def value(self):
+        return self.field.load(self.instance)
+
+    @value.setter
+    def value(self, value):
+        self.field.store(self.instance, value)
+        # the cached elements of a CachedType object are dropped as on assignment
+        invalidate = getattr(self.instance, 'invalidate', None)
+        if invalidate is not None:
+            invalidate()
+
+
+class RestrictedSimpleType(SimpleType):
+    """SimpleType whose values are checked by the Restriction <restriction> of its class
+    """
+    __slots__ = ()
+    restriction = None
+
+    def check_restriction(self, value):
+        if self.restriction is not None and not self.restriction(value):
+            raise ValueError('<%s> value %s is invalid: expected (%s)' % (self.tagname, value, self.restriction))
+
+
+class XField(object):
+    """Storage of the values of a descriptor field.
+    They're kept in the instance __dict__, or in the <slot> of a RecordType field
+    """
+    slot = None
+
+    def store(self, instance, value):
+        if self.slot is None:
+            instance.__dict__[self.name] = value
+        else:
+            setattr(instance, self.slot, value)
+
+    def load(self, instance):
+        """Returns the value of <instance>, None for a field not set
+        """
+        if self.slot is None:
+            return instance.__dict__.get(self.name)
+        return getattr(instance, self.slot, None)
+
+
+class Restriction(object):
+    """Restriction facets of a value, compiled once into a single check:
+    the <enumeration> into a frozenset, the <pattern> into a regular expression matching
+    the whole text and the bounds into comparisons, made on <converter>(value) if given.
+    e.g: Restriction(enumeration=codes) or Restriction(min_inclusive=0, max_exclusive=100, converter=int)
+    """
+    facet_names = ('enumeration', 'pattern', 'min_inclusive', 'max_inclusive', 'min_exclusive',
+                   'max_exclusive', 'length', 'min_length', 'max_length')
+
+    def __init__(self, enumeration=None, pattern=None, min_inclusive=None, max_inclusive=None,
+                 min_exclusive=None, max_exclusive=None, length=None, min_length=None,
+                 max_length=None, converter=None):
+        facets = (enumeration, pattern, min_inclusive, max_inclusive, min_exclusive, max_exclusive,
+                  length, min_length, max_length)
+        self.facets = OrderedDict((name, facet) for name, facet in zip(self.facet_names, facets)
+                                  if facet is not None)
+        self.converter = converter
+        checks = []
+        if enumeration is not None:
+            checks.append(frozenset(enumeration).__contains__)
+        if pattern is not None:
+            match = re.compile('(?:%s)\\Z' % pattern, re.UNICODE).match
+            checks.append(lambda value: match(value if isinstance(value, string_types) else text_type(value)))
+        bounds = [(operator.le, min_inclusive), (operator.ge, max_inclusive),
+                  (operator.lt, min_exclusive), (operator.gt, max_exclusive)]
+        # bound(value) is <bound> <op> value, e.g: min_inclusive <= value
+        bounds = [functools.partial(op, bound) for op, bound in bounds if bound is not None]
+        if bounds and converter is not None:
+            checks.extend(lambda value, bound=bound: bound(converter(value)) for bound in bounds)
+        else:
+            checks.extend(bounds)
+        lengths = [(operator.eq, length), (operator.le, min_length), (operator.ge, max_length)]
+        checks.extend(lambda value, op=op, bound=bound: op(bound, len(value))
+                      for op, bound in lengths if bound is not None)
+        if len(checks) == 1:
+            self.validate = checks[0]
+        else:
+            self.validate = lambda value: all(check(value) for check in checks)
+
+    def __call__(self, value):
+        """Tells whether <value> is valid, values that can't be compared being invalid
+        """
+        try:
+            return bool(self.validate(value))
+        except (TypeError, ValueError):
+            return False
+
+    def __str__(self):
+        return ', '.join('%s %r' % (name, value) for name, value in self.facets.items())
 
+
+class XSimpleType(XField):
+
+    xml_kind = NODE
     default_error_msg = 'tagname <%(tagname)s> value %(value)s is invalid: expected (%(restriction)s)'
 
     def __init__(self, name=None, restriction=None, checker=None, error_msg=None, **kwargs):
@@ -72,6 +376,8 @@ class XSimpleType(object):
             self.name = name
         self.restriction_values = restriction
         self.checker = checker
+        # a Restriction is checked without calling <checker>
+        self.validate = restriction.validate if checker is None and isinstance(restriction, Restriction) else None
         # if no erro message set default
         if error_msg is None:
             error_msg = self.default_error_msg
@@ -81,33 +387,70 @@ class XSimpleType(object):
         self.attrib = kwargs.get('attrib', {})
 
     def __set__(self, instance, value):
-        if self.checker:
+        recorder = instrumentation.recorder
+        if recorder is not None:
+            start = timer()
+        report = validation_context.report
+        if report is None:
+            self._check(instance, value)
+        elif report.mode != OFF:
+            try:
+                self._check(instance, value)
+            except ValueError as error:
+                report.add('%s/%s' % (instance.tagname, self.name), value, error)
+        if recorder is not None:
+            recorder.record(VALIDATION, instance.__class__.__name__, timer() - start)
+        self.assign(instance, value)
+
+    def _check(self, instance, value):
+        if self.validate is not None:
+            try:
+                valid = self.validate(value)
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                raise self.error(instance, value)
+        elif self.checker:
             self.check(instance, value)
         else:
             self.check_restriction(instance, value)
-        if not self.tagname:
-            self.tagname = self.name
-        value = NoRestrictionSimpleType(value, self.tagname, self.nsmap, self.attrib)
-        instance.__dict__[self.name] = value
+
+    def assign(self, instance, value):
+        """Sets <value> without checking it.
+        Only the value is stored, the element is built from it and the descriptor
+        """
+        self.store(instance, value)
 
     def __get__(self, instance, klass):
         if instance is None:
             return self
-        return instance.__dict__[self.name]
+        # the simple type is created when the field is read, its value is the one of <instance>
+        return FieldSimpleType(self, instance)
+
+    def build(self, instance, parent, parent_factory):
+        """Adds the element of the value of <instance> to <parent> (see BaseType._build)
+        """
+        factory = ElementFactory.get(nsmap=self.nsmap)
+        return build_simple(parent, parent_factory, factory, factory.qualify(self.tagname or self.name),
+                            self.attrib or None, self.load(instance))
 
     def check(self, instance, value):
         if not self.checker(value, self.restriction_values):
-            error_data = dict(tagname=instance.tagname, value=value,
-                              restriction=self.restriction_values)
-            raise ValueError(self.error_msg % (error_data))
+            raise self.error(instance, value)
+
+    def error(self, instance, value):
+        error_data = dict(tagname=instance.tagname, value=value,
+                          restriction=self.restriction_values)
+        return ValueError(self.error_msg % (error_data))
 
     def check_restriction(self, instance, value):
         raise NotImplementedError(
             '<%s> does not implement <check_restriction> method' % instance.__class__.__name__)
 
 
-class XDateTimeType(object):
+class XDateTimeType(XField):
 
+    xml_kind = TEXT
     dtype = None
 
     def __init__(self, name, value=None):
@@ -115,16 +458,19 @@ class XDateTimeType(object):
         self.value = value
 
     def __set__(self, instance, value):
-        parsed_date = dateutil_parse(value)
-        if self.dtype:
-            instance.__dict__[self.name] = getattr(parsed_date, self.dtype)().isoformat()
-        else:
-            instance.__dict__[self.name] = parsed_date.isoformat()
+        recorder = instrumentation.recorder
+        if recorder is None:
+            self.store(instance, date_parser.isoformat(value, self.dtype))
+            return
+        start = timer()
+        value = date_parser.isoformat(value, self.dtype)
+        recorder.record(DATES, instance.__class__.__name__, timer() - start, 1)
+        self.store(instance, value)
 
     def __get__(self, instance, klass):
         if instance is None:
             return self
-        return instance.__dict__[self.name]
+        return self.load(instance)
 
 
 class XDateType(XDateTimeType):
@@ -138,7 +484,43 @@ class XTimeType(XDateTimeType):
 
 
 class DataComplexType(ComplexType):
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         for attr, value in kwargs.items():
             setattr(self, attr, value)
+
+
+class _RecordMeta(type):
+    """Generates the __slots__ of a RecordType class from its <_sequence> and descriptors
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        descriptors = [(getattr(descriptor, 'name', attr), descriptor) for attr, descriptor in namespace.items()
+                       if isinstance(descriptor, XField)]
+        sequence = namespace.get('_sequence')
+        if sequence is None:
+            sequence = next((base._sequence for base in bases if getattr(base, '_sequence', None)), ())
+        sequence = tuple(sequence)
+        sequence += tuple(field for field, descriptor in descriptors if field not in sequence)
+        slots = list(namespace.get('__slots__', ()))
+        for field, descriptor in descriptors:
+            descriptor.slot = '_value_%s' % field
+            slots.append(descriptor.slot)
+        fields = set(field for field, descriptor in descriptors)
+        slots.extend(field for field in sequence
+                     if field not in fields and not any(hasattr(base, field) for base in bases))
+        namespace['__slots__'] = tuple(slots)
+        namespace['_sequence'] = sequence
+        return super(_RecordMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
+# created through its metaclass, the class statement syntax of which differs in python 2 and 3
+RecordType = _RecordMeta(str('RecordType'), (DataComplexType,), {
+    '__doc__': """Compact DataComplexType for high volume records.
+    Its instances have no __dict__: fields are the slots generated from <_sequence>
+    and the descriptors of the class, fields not set being left out of the element.
+    The namespace map and attributes of the records are the ones of their class
+    """,
+    '__module__': __name__,
+})
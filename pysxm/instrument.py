@@ -0,0 +1,147 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+
+# phases of the marshalling: restriction checks, date parsing, tree building, deannotation,
+# XML schema validation (pysxm.schema), serialization into bytes (to_bytes, write_to)
+# and streaming (pysxm.stream)
+VALIDATION, DATES, BUILD, DEANNOTATE, SCHEMA, SERIALIZATION, STREAM = (
+    'validation', 'dates', 'build', 'deannotate', 'schema', 'serialization', 'stream')
+
+# what the amount recorded for a phase counts
+UNITS = {DATES: 'values', BUILD: 'elements', SERIALIZATION: 'bytes', STREAM: 'bytes'}
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class _Context(object):
+    # the recorder of the process, None when instrumentation is disabled
+    recorder = None
+
+    def __init__(self):
+        # the recorders entered and not left yet, by any thread: the last one entered records
+        self.active = []
+        self.lock = threading.Lock()
+
+    def enter(self, recorder):
+        with self.lock:
+            self.active.append(recorder)
+            self.recorder = recorder
+
+    def leave(self, recorder):
+        """Removes <recorder>, contexts of other threads may have been entered or left since
+        """
+        with self.lock:
+            active = self.active
+            del active[len(active) - 1 - active[::-1].index(recorder)]
+            self.recorder = active[-1] if active else None
+
+
+context = _Context()
+
+
+def current_instrumentation():
+    """Returns the Instrumentation recording the marshalling, if any
+    """
+    return context.recorder
+
+
+class CountingOutput(object):
+    """Forwards writes to <output> counting their bytes
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.output.write(data)
+
+
+class Instrumentation(object):
+    """Counters and timings of the marshalling by phase and class.
+    Used as a context manager, it records what all the threads marshal until it's left.
+    When contexts overlap, in one thread or several, the last one entered and not left records.
+    Each record is also passed to the <hooks>, as hook(phase, name, seconds, amount).
+    Phases nest: the build of a simple type written by a stream is recorded in both
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        # {(phase, name): [calls, seconds, amount]}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        context.enter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        context.leave(self)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, phase, name, seconds, amount=0):
+        with self.lock:
+            counter = self.counters.get((phase, name))
+            if counter is None:
+                counter = self.counters[(phase, name)] = [0, 0.0, 0]
+            counter[0] += 1
+            counter[1] += seconds
+            counter[2] += amount
+        for hook in self.hooks:
+            hook(phase, name, seconds, amount)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+
+    def as_dict(self):
+        """Returns the counters as {phase: {name: {'calls': ..., 'seconds': ..., <unit>: ...}}},
+        <unit> being the one of the phase in UNITS, if any
+        """
+        result = {}
+        with self.lock:
+            counters = list(self.counters.items())
+        for (phase, name), (calls, seconds, amount) in counters:
+            stats = dict(calls=calls, seconds=seconds)
+            if phase in UNITS:
+                stats[UNITS[phase]] = amount
+            result.setdefault(phase, {})[name] = stats
+        return result
+
+
+def instrumentation(hooks=()):
+    """Returns an Instrumentation to use as a context manager, e.g:
+
+        with instrumentation() as stats:
+            catalog.write_to('catalog.xml')
+        metrics.send(stats.as_dict())
+    """
+    return Instrumentation(hooks)
+
+
+__all__ = ['BUILD', 'DATES', 'DEANNOTATE', 'SCHEMA', 'SERIALIZATION', 'STREAM', 'UNITS', 'VALIDATION',
+           'Instrumentation', 'current_instrumentation', 'instrumentation']
@@ -0,0 +1,218 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+
+import itertools
+import re
+
+from lxml import etree
+
+from pysxm.pysxm import LIST, NODE, TEXT, BaseType, ElementFactory, SerializationPlan, SimpleType
+
+_parser = etree.XMLParser(remove_comments=True, remove_pis=True)
+
+# declaration of a document given as text, its encoding being the one of the bytes it came from
+_declaration = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+_booleans = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def tag_of(klass):
+    """Returns the qualified tag of the elements of <klass>
+    """
+    plan = SerializationPlan.get(klass)
+    return plan.tag or plan.factory.qualify(klass._tagname or klass.__name__.lower())
+
+
+def _localname(tag):
+    return tag[tag.index('}') + 1:] if tag[:1] == '{' else tag
+
+
+def _boolean(text):
+    try:
+        return _booleans[text.strip()]
+    except KeyError:
+        raise ValueError('%r is not a boolean: expected true, false, 1 or 0' % text)
+
+
+class ParsePlan(object):
+    """Compiled unmarshalling of a BaseType class.
+    It maps the qualified tags of the child elements to (field, kind, type) entries,
+    <type> being a BaseType subclass, a text converter or for lists a {tag: class} map.
+    <assign> holds the setters of the descriptor fields used when validation is off
+    """
+
+    def __init__(self, klass):
+        self.klass = klass
+        self.signature = self.signature_of(klass)
+        self.tag = tag_of(klass)
+        self.complex = SerializationPlan.get(klass).complex
+        self.factory = SerializationPlan.get(klass).factory
+        # a SimpleType which only checks its value in __init__ can be created without it
+        self.check_only = issubclass(klass, SimpleType) and klass.__init__ is SimpleType.__init__
+        self.fields, self.assign = {}, {}
+        if self.complex:
+            self.compile(klass)
+
+    @staticmethod
+    def signature_of(klass):
+        return SerializationPlan.signature_of(klass) + (getattr(klass, '_types', None),)
+
+    @classmethod
+    def get(cls, klass):
+        """Returns the plan of <klass>, compiling it if needed
+        """
+        plan = klass.__dict__.get('_parse_plan')
+        if plan is None or plan.signature != cls.signature_of(klass):
+            plan = cls(klass)
+            klass._parse_plan = plan
+        return plan
+
+    def compile(self, klass):
+        fields, qualify = self.fields, self.factory.qualify
+        sequence = getattr(klass, 'sequence', None)
+        if not isinstance(sequence, (list, tuple)):
+            sequence = klass._sequence or ()
+        for name in sequence:
+            fields[qualify(name)] = (name, TEXT, None)
+        for name, type_ in (getattr(klass, '_types', None) or {}).items():
+            if isinstance(type_, (list, tuple)):
+                fields[qualify(name)] = (name, LIST, dict((tag_of(member), member) for member in type_))
+            elif isinstance(type_, type) and issubclass(type_, BaseType):
+                # the element of a field is the one of its class: two fields can't share it
+                tag = tag_of(type_)
+                entry = fields.get(tag)
+                if entry is not None and entry[1] is NODE:
+                    raise ValueError('%s fields %s and %s both hold <%s> elements' % (
+                        klass.__name__, entry[0], name, _localname(tag)))
+                fields.pop(qualify(name), None)
+                fields[tag] = (name, NODE, type_)
+            else:
+                fields[qualify(name)] = (name, TEXT, _boolean if type_ is bool else type_)
+        for base in reversed(klass.__mro__):
+            for name, descriptor in vars(base).items():
+                kind = getattr(descriptor, 'xml_kind', None)
+                if kind is not None and hasattr(descriptor, 'assign'):
+                    self.assign[name] = descriptor.assign
+                if kind is TEXT:
+                    fields[qualify(name)] = (name, TEXT, None)
+                elif kind is NODE:
+                    # XSimpleType: the element of its own tag and namespace map holds the text
+                    fields.pop(qualify(name), None)
+                    tagname = descriptor.tagname or getattr(descriptor, 'name', name)
+                    fields[ElementFactory.get(nsmap=descriptor.nsmap).qualify(tagname)] = (name, TEXT, None)
+
+    def field(self, tag, element):
+        """Returns the entry of the child element <tag>, those of unknown fields holding text
+        """
+        entry = self.fields.get(tag)
+        if entry is not None:
+            return entry
+        namespace = tag[1:tag.index('}')] if tag[:1] == '{' else None
+        if namespace != self.factory.namespace or len(element):
+            raise ValueError('<%s> unexpected element <%s>' % (_localname(self.tag), _localname(tag)))
+        return _localname(tag), TEXT, None
+
+
+def from_element(klass, element, validate=True):
+    """Returns the <klass> instance of <element>.
+    Values are set as the constructors or descriptors would, so that restrictions are checked.
+    The __init__ of ComplexType classes isn't called, their fields being set one by one.
+    Without <validate>, restrictions aren't checked whenever they can be skipped
+    """
+    plan = ParsePlan.get(klass)
+    if element.tag != plan.tag:
+        raise ValueError('<%s> expected, got <%s>' % (_localname(plan.tag), _localname(element.tag)))
+    return _load(klass, plan, element, validate)
+
+
+def _load(klass, plan, element, validate=True):
+    if not plan.complex:
+        if validate or not plan.check_only:
+            obj = klass(element.text)
+        else:
+            obj = klass.__new__(klass)
+            obj.value = element.text
+    else:
+        obj = klass.__new__(klass)
+        for child in element.iterchildren(etree.Element):
+            name, kind, type_ = plan.field(child.tag, child)
+            if kind is TEXT:
+                value = child.text if type_ is None or child.text is None else type_(child.text)
+            elif kind is NODE:
+                value = _load(type_, ParsePlan.get(type_), child, validate)
+            else:
+                value = []
+                for member in child.iterchildren(etree.Element):
+                    member_class = type_.get(member.tag)
+                    if member_class is None:
+                        raise ValueError('<%s> unexpected element <%s>' % (
+                            _localname(child.tag), _localname(member.tag)))
+                    value.append(_load(member_class, ParsePlan.get(member_class), member, validate))
+            if not validate and name in plan.assign:
+                plan.assign[name](obj, value)
+            else:
+                setattr(obj, name, value)
+    attrib = dict(element.attrib)
+    if attrib != (klass.attrib or {}):
+        try:
+            obj.attrib = attrib
+        except AttributeError:
+            # a RecordType has the attributes of its class
+            raise ValueError('<%s> attributes %r differ from the ones of %s: %r' % (
+                _localname(element.tag), attrib, klass.__name__, klass.attrib or {}))
+    return obj
+
+
+def from_xml(klass, xml, validate=True):
+    """Returns the <klass> instance of the document <xml>, a string or bytes
+    """
+    if not isinstance(xml, bytes):
+        # the text is parsed as is, lxml refusing the encoding of a declaration
+        xml = _declaration.sub('', xml, 1)
+    return from_element(klass, etree.fromstring(xml, _parser), validate)
+
+
+def parse(klass, source, validate=True):
+    """Returns the <klass> instance of the document <source>, a path or a file object
+    """
+    return from_element(klass, etree.parse(source, _parser).getroot(), validate)
+
+
+def iterparse(klass, source, validate=True):
+    """Yields the <klass> instances of the document <source>, a path or a file object,
+    as their elements end. Processed elements and their preceding siblings are then
+    dropped so that memory doesn't grow with the document
+    """
+    plan = ParsePlan.get(klass)
+    events = etree.iterparse(source, events=('end',), tag=plan.tag, remove_comments=True, remove_pis=True)
+    for event, element in events:
+        if any(ancestor.tag == plan.tag for ancestor in element.iterancestors()):
+            # part of an enclosing instance
+            continue
+        yield _load(klass, plan, element, validate)
+        element.clear()
+        for node in itertools.chain((element,), element.iterancestors()):
+            parent = node.getparent()
+            while node.getprevious() is not None:
+                del parent[0]
+
+
+__all__ = ['from_element', 'from_xml', 'iterparse', 'parse']
@@ -19,11 +19,62 @@
 # SOFTWARE.
 from __future__ import unicode_literals
 
-import io
 import sys
+from decimal import Decimal
 
 from lxml import etree, objectify as xobject
 
+from pysxm.instrument import (BUILD, DEANNOTATE, SERIALIZATION, VALIDATION, CountingOutput,
+                              context as instrumentation, timer)
+from pysxm.validation import OFF, context as validation_context
+
+
+PY3 = sys.version_info.major > 2
+
+if PY3:
+    string_types, text_type = (str, bytes), str
+else:
+    string_types, text_type = (basestring,), unicode  # noqa: F821
+
+# handler kinds of the values of a ComplexType
+TEXT, LIST, NODE = 'text', 'list', 'node'
+
+_pytypes = dict((pytype.name, pytype) for pytype in xobject.getRegisteredTypes())
+
+# (kind, converter) of the registered types, a None converter means the value is the text
+_registered = {
+    list: (LIST, None),
+    tuple: (LIST, None),
+    Decimal: (TEXT, text_type),
+    int: (TEXT, _pytypes['int'].stringify),
+    float: (TEXT, _pytypes['float'].stringify),
+    bool: (TEXT, _pytypes['bool'].stringify),
+}
+for _type in string_types:
+    _registered[_type] = (TEXT, None)
+if not PY3:
+    _registered[long] = (TEXT, _pytypes['long'].stringify)  # noqa: F821
+
+# handlers by exact type, completed as subclasses of registered types are met
+_dispatch = dict(_registered)
+
+
+def register_type(type_, converter=text_type):
+    """Registers how values of <type_> and its subclasses are turned into text
+    e.g: register_type(uuid.UUID) or register_type(enum.Enum, lambda e: e.value)
+    """
+    _registered[type_] = (TEXT, converter)
+    _dispatch.clear()
+    _dispatch.update(_registered)
+
+
+def unregister_type(type_):
+    """Removes the converter registered for <type_>
+    """
+    _registered.pop(type_, None)
+    _dispatch.clear()
+    _dispatch.update(_registered)
+
 
 def is_clean(element):
     """Checks if an element has at least a child
@@ -36,10 +87,13 @@ def is_clean(element):
 def is_safe_type(value):
     """Returns True if <value> is string or numeric type
     """
-    py3 = True if sys.version_info.major > 2 else False
-    safe_text = isinstance(value, (str, bytes) if py3 else (basestring,))
-    if safe_text:
+    handler = _dispatch.get(value.__class__)
+    if handler is not None:
+        return handler[0] is TEXT
+    if isinstance(value, string_types):
         return True
+    if isinstance(value, (BaseType, list, tuple)):
+        return False
     try:
         float(value)
         return True
@@ -49,24 +103,263 @@ def is_safe_type(value):
     return False
 
 
+def check_list_value(name, values, value):
+    """Raises if <value>, member of the list <values> of field <name>, can't be serialized
+    """
+    if not isinstance(value, (ComplexType, SimpleType)):
+        raise Exception("list ({}) values ({}) must be <ComplexType> or <SimpleType>: {} is {} ".format(name, values, value, type(value)))
+
+
+def _objectify_text(value):
+    """Returns the text of <value> as objectify.ElementMaker renders it
+    """
+    if isinstance(value, string_types):
+        return value
+    pytype = _pytypes.get(type(value).__name__)
+    if pytype is not None:
+        return pytype.stringify(value)
+    return text_type(value)
+
+
+def value_handler(value):
+    """Returns the (kind, converter) handling <value>
+    """
+    klass = value.__class__
+    handler = _dispatch.get(klass)
+    if handler is not None:
+        return handler
+    for type_, handler in _registered.items():
+        if isinstance(value, type_):
+            _dispatch[klass] = handler
+            return handler
+    if isinstance(value, BaseType):
+        handler = _dispatch[klass] = (NODE, None)
+        return handler
+    # unknown type, the value is checked as it always was
+    if is_safe_type(value):
+        return TEXT, _objectify_text
+    return NODE, None
+
+
+def stringify(value):
+    """Returns the text of <value>
+    """
+    kind, converter = value_handler(value)
+    if kind is not TEXT:
+        return _objectify_text(value)
+    return value if converter is None else _objectify_text(converter(value))
+
+
+# objectified elements expose a read-only <text>, the one of the base class is writable
+_set_text = etree._Element.text.__set__
+
+# objectify parser used to create root elements without any annotation
+_parser = xobject.makeparser()
+
+
+def _make_element(parent, parent_factory, factory, tag, attrib):
+    """Returns the element <tag> of <factory> and whether it's detached from <parent>.
+    An element of its parent namespace map (or of none) is added to <parent>,
+    the others have to be appended once complete
+    """
+    if parent is None:
+        return _parser.makeelement(tag, attrib, factory.nsmap), True
+    if factory is parent_factory or not factory.nsmap:
+        return etree.SubElement(parent, tag, attrib, factory.nsmap), False
+    return _parser.makeelement(tag, attrib, factory.nsmap), True
+
+
+def build_simple(parent, parent_factory, factory, tag, attrib, value):
+    """Returns the element <tag> holding <value> and whether it's clean (see <is_clean>),
+    adding it to <parent> if given
+    """
+    element, detached = _make_element(parent, parent_factory, factory, tag, attrib)
+    if value is not None:
+        _set_text(element, stringify(value))
+    if parent is not None and detached:
+        parent.append(element)
+    return element, element.text is not None
+
+
+def _write_options(encoding, xml_declaration, pretty_print, c14n, exclusive):
+    """Returns the keyword arguments of etree.tostring and ElementTree.write
+    """
+    if not (c14n or exclusive):
+        return dict(method='xml', encoding=encoding, xml_declaration=xml_declaration, pretty_print=pretty_print)
+    if encoding not in (None, 'utf-8', 'UTF-8') or xml_declaration or pretty_print:
+        raise ValueError('canonical XML is utf-8 encoded, without declaration nor pretty printing')
+    return dict(method='c14n', exclusive=exclusive)
+
+
+class ElementFactory(object):
+    """Creates elements of a namespace map.
+    Qualified tag names are computed once per tag name
+    """
+    _factories = {}
+    # maximum number of factories and of qualified tags per factory remembered
+    max_factories = 256
+    max_tags = 256
+
+    def __init__(self, namespace=None, nsmap=None):
+        if nsmap:
+            namespace = list(nsmap.values())[0]
+        self.namespace = namespace
+        # a copy, the factory being cached by the items of <nsmap>
+        self.nsmap = dict(nsmap) if nsmap else None
+        self.tags = {}
+
+    @classmethod
+    def get(cls, namespace=None, nsmap=None):
+        """Returns the cached factory of (<namespace>, <nsmap>),
+        a new one when <max_factories> are already cached
+        """
+        key = (namespace, tuple(nsmap.items()) if nsmap else None)
+        factory = cls._factories.get(key)
+        if factory is None:
+            factory = cls(namespace, nsmap)
+            if len(cls._factories) < cls.max_factories:
+                cls._factories[key] = factory
+        return factory
+
+    def qualify(self, tagname):
+        tag = self.tags.get(tagname)
+        if tag is None:
+            tag = tagname if not self.namespace else '{%s}%s' % (self.namespace, tagname)
+            if len(self.tags) < self.max_tags:
+                self.tags[tagname] = tag
+        return tag
+
+    def element(self, tagname, value=None, attrib=None):
+        element = _parser.makeelement(self.qualify(tagname), attrib, self.nsmap)
+        if value is not None:
+            _set_text(element, stringify(value))
+        return element
+
+    def subelement(self, parent, tagname, value=None, attrib=None):
+        element = etree.SubElement(parent, self.qualify(tagname), attrib, self.nsmap)
+        if value is not None:
+            _set_text(element, stringify(value))
+        return element
+
+
+class SerializationPlan(object):
+    """Compiled serialization of a BaseType class.
+    It's computed the first time the class is serialized and holds what only
+    depends on the class: element factory, tag names, fields and their handler kind.
+    It's compiled again as soon as one of the class attributes it relies on is reassigned,
+    or a sequence list of the class changed in place. Instances defining their own sequence
+    are serialized by it
+    """
+    # maximum number of field sets remembered for classes without sequence
+    max_shapes = 256
+
+    def __init__(self, klass):
+        self.klass = klass
+        self.signature = self.signature_of(klass)
+        self.nsmap = klass.nsmap
+        self.factory = ElementFactory.get(nsmap=klass.nsmap)
+        self.complex = issubclass(klass, ComplexType)
+        tagname = getattr(klass, 'tagname', None)
+        # a tag name defined as a plain class attribute can't vary per instance
+        self.tag = self.factory.qualify(tagname) if isinstance(tagname, string_types) else None
+        # the entries of the fields, those of the class <sequence_attr> <sequence>
+        self.entries, self.sequence_attr, self.sequence, self.shapes = None, None, None, {}
+        # fields whose descriptor builds the element from the value it stores
+        self.builders = {}
+        if not self.complex:
+            return
+        for base in reversed(klass.__mro__):
+            for name, descriptor in vars(base).items():
+                if getattr(descriptor, 'xml_kind', None) is NODE and hasattr(descriptor, 'build'):
+                    self.builders[name] = descriptor.build
+        sequence = getattr(klass, 'sequence', None)
+        # instances may still define their own <sequence> or <_sequence>
+        if isinstance(sequence, (list, tuple)):
+            self.sequence_attr, self.sequence = 'sequence', sequence
+        elif sequence is ComplexType.sequence and klass._sequence:
+            self.sequence_attr, self.sequence = '_sequence', klass._sequence
+        if self.sequence is not None:
+            self.entries = self.compile(klass, self.sequence)
+
+    @staticmethod
+    def signature_of(klass):
+        # the items of the namespace map and of the sequence lists, which may be updated in place
+        nsmap = tuple(klass.nsmap.items()) if klass.nsmap else None
+        sequence, _sequence = getattr(klass, 'sequence', None), getattr(klass, '_sequence', None)
+        return (getattr(klass, 'tagname', None), klass._tagname,
+                tuple(sequence) if isinstance(sequence, list) else sequence,
+                tuple(_sequence) if isinstance(_sequence, list) else _sequence, nsmap, klass.attrib)
+
+    @classmethod
+    def get(cls, klass):
+        """Returns the plan of <klass>, compiling it if needed
+        """
+        plan = klass.__dict__.get('_plan')
+        if plan is None or plan.signature != cls.signature_of(klass):
+            plan = cls(klass)
+            klass._plan = plan
+        return plan
+
+    def compile(self, klass, names):
+        """Returns the (field, qualified tag, handler kind) entries of <names>.
+        The kind is known upfront for fields handled by a descriptor declaring
+        an <xml_kind>, it's resolved from the value otherwise
+        """
+        return tuple((name, self.factory.qualify(name),
+                      getattr(getattr(klass, name, None), 'xml_kind', None))
+                     for name in names)
+
+    def factory_of(self, instance):
+        """Returns the element factory of <instance>, which may define its own <nsmap>
+        """
+        nsmap = instance.nsmap
+        if nsmap is self.nsmap:
+            return self.factory
+        return ElementFactory.get(nsmap=nsmap)
+
+    def tag_of(self, instance, factory):
+        """Returns the qualified tag of <instance>, <factory> being its element factory
+        """
+        if self.tag is not None and factory is self.factory:
+            return self.tag
+        return factory.qualify(instance.tagname)
+
+    def fields(self, instance, factory=None):
+        """Returns the entries of the fields of <instance>,
+        their tags being qualified by <factory> when it's not the one of the class
+        """
+        if factory is not None and factory is not self.factory:
+            return tuple((name, factory.qualify(name), kind)
+                         for name, tag, kind in self.fields(instance))
+        if self.entries is not None and getattr(instance, self.sequence_attr) is self.sequence:
+            return self.entries
+        names = tuple(instance.sequence)
+        entries = self.shapes.get(names)
+        if entries is None:
+            entries = self.compile(instance.__class__, names)
+            if len(self.shapes) < self.max_shapes:
+                self.shapes[names] = entries
+        return entries
+
+
 class BaseType(object):
     """Base data binding object
     """
+    # no slot of its own so that subclasses may define theirs (see pysxm.ext.RecordType)
+    __slots__ = ()
     _tagname = None
     namespace = None
     nsmap = None
     attrib = {}
+    # validator of the documents built by <xml>, see pysxm.schema
+    xml_schema = None
 
     def __repr__(self):
         return '<%s>' % self.tagname
 
     @classmethod
     def make_element(cls, tagname, value=None, namespace=None, nsmap=None):
-        if nsmap:
-            namespace = list(nsmap.values())[0]
-        M = xobject.ElementMaker(annotate=False, namespace=namespace,
-                                 nsmap=nsmap)
-        return M(tagname, value)
+        return ElementFactory.get(namespace, nsmap).element(tagname, value)
 
     @property
     def tagname(self):
@@ -78,54 +371,180 @@ class BaseType(object):
     def klass(self):
         return self.__class__
 
-    @property
-    def xml(self):
-        if not isinstance(self, (ComplexType,)):
-            element = self.make_element(self.tagname, self.value, nsmap=self.klass.nsmap)
-        else:
-            element = self.make_element(self.tagname, nsmap=self.klass.nsmap)
-            for subelt in self.sequence:
-                attr = getattr(self, subelt, None)
-                if not attr and attr != 0:
+    @classmethod
+    def from_xml(cls, xml, validate=True):
+        """Returns the instance of the document <xml> (see pysxm.parse)
+        """
+        from pysxm.parse import from_xml
+        return from_xml(cls, xml, validate)
+
+    @classmethod
+    def parse(cls, source, validate=True):
+        """Returns the instance of the document <source>, a path or a file object (see pysxm.parse)
+        """
+        from pysxm.parse import parse
+        return parse(cls, source, validate)
+
+    @classmethod
+    def iterparse(cls, source, validate=True):
+        """Yields the instances found in the document <source> as they are read (see pysxm.parse)
+        """
+        from pysxm.parse import iterparse
+        return iterparse(cls, source, validate)
+
+    def make_tree(self):
+        """Builds the element of the object and its children.
+        The tree is neither deannotated nor cleaned up from unused namespaces,
+        that's done once on the root element by <xml>
+        """
+        return self._build()[0]
+
+    def _build(self, parent=None, parent_factory=None):
+        """Returns the element of the object and whether it's clean (see <is_clean>).
+        Emptiness is reported bottom-up so that no subtree is scanned twice.
+        When <parent> is given, the element is added to it and the caller is
+        in charge of removing it if it's not clean
+        """
+        plan = SerializationPlan.get(self.__class__)
+        factory = plan.factory_of(self)
+        tag = plan.tag_of(self, factory)
+        if not plan.complex:
+            return build_simple(parent, parent_factory, factory, tag, self.attrib or None, self.value)
+        element, detached = _make_element(parent, parent_factory, factory, tag, self.attrib or None)
+
+        # a complex element is clean if it has children which are all clean
+        clean, has_children = True, False
+        nsmap, builders = factory.nsmap, plan.builders
+        for subelt, subtag, kind in plan.fields(self, factory):
+            if kind is NODE and subelt in builders:
+                xml, xclean = builders[subelt](self, element, factory)
+                if not xclean:
+                    element.remove(xml)
                     continue
-                if is_safe_type(attr):
-                    element.append(self.make_element(subelt, attr, nsmap=self.klass.nsmap))
-                elif isinstance(attr, (list,)):
-                    list_element = self.make_element(subelt, None, nsmap=self.klass.nsmap)
-                    for e in attr:
-                        if not isinstance(e, (ComplexType, SimpleType)):
-                            raise Exception("list ({}) values ({}) must be <ComplexType> or <SimpleType>: {} is {} ".format(subelt, attr, e, type(e)))
-                        exml = e.xml
-                        if not is_clean(exml):
-                            continue
-                        list_element.append(exml)            
-                    element.append(list_element)
-                else:
-                    xml = attr.xml
-                    if not is_clean(xml):
+                has_children = True
+                continue
+            attr = getattr(self, subelt, None)
+            if not attr and attr != 0:
+                continue
+            if kind is None:
+                kind, converter = value_handler(attr)
+            else:
+                converter = stringify
+            if kind is TEXT:
+                # a registered converter may return a value which isn't text
+                _set_text(etree.SubElement(element, subtag, None, nsmap),
+                          attr if converter is None else _objectify_text(converter(attr)))
+                has_children = True
+            elif kind is LIST:
+                list_element = etree.SubElement(element, subtag, None, nsmap)
+                list_clean = False
+                for e in attr:
+                    check_list_value(subelt, attr, e)
+                    exml, eclean = e._build(list_element, factory)
+                    if not eclean:
+                        list_element.remove(exml)
                         continue
-                    element.append(xml)
+                    list_clean = True
+                clean = clean and list_clean
+                has_children = True
+            else:
+                xml, xclean = attr._build(element, factory)
+                if not xclean:
+                    element.remove(xml)
+                    continue
+                has_children = True
+        if parent is not None and detached:
+            # appended once complete, lxml then merges the namespaces already declared by the parent
+            parent.append(element)
+        return element, clean and has_children
+
+    @property
+    def xml(self):
+        recorder = instrumentation.recorder
+        if recorder is not None:
+            return self._instrumented_xml(recorder)
+        element = self.make_tree()
         xobject.deannotate(element, xsi_nil=True, cleanup_namespaces=True)
-        # set element attributes
-        for key, value in self.attrib.items():
-            element.set(key, value)
+        if self.xml_schema is not None:
+            self.xml_schema.check(self, element)
+        return element
+
+    def _instrumented_xml(self, recorder):
+        name = self.__class__.__name__
+        start = timer()
+        element = self.make_tree()
+        built = timer()
+        xobject.deannotate(element, xsi_nil=True, cleanup_namespaces=True)
+        recorder.record(DEANNOTATE, name, timer() - built)
+        recorder.record(BUILD, name, built - start, sum(1 for _ in element.iter()))
+        if self.xml_schema is not None:
+            self.xml_schema.check(self, element)
         return element
 
     def __str__(self):
         return '{}'.format(etree.tostring(self.xml, pretty_print=True))
 
-    def save(self, filename):
-        with io.open(filename, 'wb') as fp:
-            content = etree.tostring(self.xml, pretty_print=True)
-            fp.write(content)
+    def save(self, filename, pretty_print=True):
+        self.write_to(filename, encoding=None, pretty_print=pretty_print)
+
+    def to_bytes(self, encoding='utf-8', xml_declaration=False, pretty_print=False, c14n=False, exclusive=False):
+        """Returns the document of the object, compact and utf-8 encoded by default.
+        <encoding> None escapes non ascii characters. With <c14n>, or <exclusive> for the
+        exclusive form, the canonical document is returned
+        """
+        options = _write_options(encoding, xml_declaration, pretty_print, c14n, exclusive)
+        element = self.xml
+        if options['method'] == 'xml':
+            # declared upper-cased as by write_to
+            options['encoding'] = encoding and encoding.upper()
+        recorder = instrumentation.recorder
+        if recorder is None:
+            return etree.tostring(element, **options)
+        start = timer()
+        data = etree.tostring(element, **options)
+        recorder.record(SERIALIZATION, self.__class__.__name__, timer() - start, len(data))
+        return data
+
+    def write_to(self, target, encoding='utf-8', xml_declaration=False, pretty_print=False, c14n=False,
+                 exclusive=False):
+        """Writes the document of the object (see <to_bytes>) into <target>, a path or a binary file object.
+        lxml writes it chunk by chunk, no bytes object holds the whole document
+        """
+        options = _write_options(encoding, xml_declaration, pretty_print, c14n, exclusive)
+        recorder = instrumentation.recorder
+        if recorder is None:
+            etree.ElementTree(self.xml).write(target, **options)
+            return
+        if not hasattr(target, 'write'):
+            # opened here to count the bytes written
+            with open(target, 'wb') as fp:
+                return self.write_to(fp, encoding, xml_declaration, pretty_print, c14n, exclusive)
+        tree = etree.ElementTree(self.xml)
+        output = CountingOutput(target)
+        start = timer()
+        tree.write(output, **options)
+        recorder.record(SERIALIZATION, self.__class__.__name__, timer() - start, output.size)
 
 
 class SimpleType(BaseType):
     """Data binding class for SimpleType
     """
+    __slots__ = ()
 
     def __init__(self, value):
-        self.check_restriction(value)
+        recorder = instrumentation.recorder
+        if recorder is not None:
+            start = timer()
+        report = validation_context.report
+        if report is None:
+            self.check_restriction(value)
+        elif report.mode != OFF:
+            try:
+                self.check_restriction(value)
+            except ValueError as error:
+                report.add(self.tagname, value, error)
+        if recorder is not None:
+            recorder.record(VALIDATION, self.__class__.__name__, timer() - start)
         self.value = value
 
     def check_restriction(self, value):
@@ -136,7 +555,10 @@ class SimpleType(BaseType):
 class ComplexType(BaseType):
     """Data binding class for ComplexType
     """
+    __slots__ = ()
     _sequence = None
+    # classes of the fields to unmarshal: {field: BaseType subclass, [list members classes] or text converter}
+    _types = None
 
     @property
     def sequence(self):
@@ -145,4 +567,4 @@ class ComplexType(BaseType):
         return self.__dict__.keys()
 
 
-__all__ = ["BaseType", "ComplexType", "SimpleType"]
+__all__ = ["BaseType", "ComplexType", "SimpleType", "register_type", "unregister_type"]
@@ -0,0 +1,121 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+
+import itertools
+import os
+import threading
+
+from lxml import etree
+
+from pysxm.instrument import SCHEMA, context as instrumentation, timer
+from pysxm.validation import OFF, context as validation_context
+
+
+class SchemaCache(object):
+    """Compiled XML schemas of the process by path.
+    A schema is compiled again when the modification time of its file changes.
+    Each schema comes with the lock of its validations, the error log of a schema
+    being set by each of them
+    """
+
+    def __init__(self):
+        # {absolute path: (mtime, XMLSchema, lock)}
+        self.schemas = {}
+        self.compilations = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        return self.entry(path)[0]
+
+    def entry(self, path):
+        """Returns the (XMLSchema, lock) of the schema of <path>
+        """
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime
+        entry = self.schemas.get(path)
+        if entry is None or entry[0] != mtime:
+            with self.lock:
+                entry = self.schemas.get(path)
+                if entry is None or entry[0] != mtime:
+                    entry = self.schemas[path] = (mtime, etree.XMLSchema(etree.parse(path)), threading.Lock())
+                    self.compilations += 1
+        return entry[1:]
+
+    def clear(self):
+        with self.lock:
+            self.schemas.clear()
+
+
+# cache of the validators which don't define their own
+schemas = SchemaCache()
+
+
+class SchemaValidator(object):
+    """Validates the elements of a class against the XML <schema>, a path or an etree.XMLSchema,
+    e.g: class PurchaseOrder(ComplexType): xml_schema = SchemaValidator('po.xsd').
+    The element built by <xml> (and so <to_bytes>, <write_to> and <save>) is validated in memory,
+    an invalid one raising etree.DocumentInvalid. Only one document out of <sample> is validated.
+    Errors are reported by a COLLECT validation context and skipped by an OFF one (see pysxm.validation).
+    The validations of a schema read from a file are serialized by the lock of its cache entry,
+    those of a schema given compiled by the lock of the validator, which is then the one to share
+    """
+
+    def __init__(self, schema, sample=1, cache=None):
+        self.schema = schema
+        self.sample = sample
+        self.cache = cache if cache is not None else schemas
+        self.documents = itertools.count()
+        # the error log of a schema is set by each validation
+        self.lock = threading.Lock()
+
+    def compiled(self):
+        return self.locked()[0]
+
+    def locked(self):
+        """Returns the (XMLSchema, lock) of the validations
+        """
+        if isinstance(self.schema, etree.XMLSchema):
+            return self.schema, self.lock
+        return self.cache.entry(self.schema)
+
+    def check(self, obj, element):
+        if next(self.documents) % self.sample:
+            return
+        report = validation_context.report
+        if report is not None and report.mode == OFF:
+            return
+        recorder = instrumentation.recorder
+        if recorder is not None:
+            start = timer()
+        schema, lock = self.locked()
+        with lock:
+            try:
+                schema.assertValid(element)
+            except etree.DocumentInvalid as error:
+                if report is None:
+                    raise
+                report.add(obj.tagname, None, error)
+            finally:
+                if recorder is not None:
+                    recorder.record(SCHEMA, obj.__class__.__name__, timer() - start)
+
+
+__all__ = ['SchemaCache', 'SchemaValidator', 'schemas']
@@ -0,0 +1,684 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+
+import collections
+import gzip
+import io
+import itertools
+import multiprocessing
+import os
+import re
+from contextlib import contextmanager
+from xml.parsers import expat
+
+from lxml import etree
+
+from pysxm.instrument import STREAM, CountingOutput, context as instrumentation, timer
+from pysxm.pysxm import (LIST, TEXT, ElementFactory, SerializationPlan, _objectify_text,
+                         check_list_value, stringify, value_handler)
+from pysxm.validation import ValidationReport
+
+
+# a namespace declaration as written by etree.xmlfile
+_declaration = re.compile(br' xmlns(?::([^=\s]+))?="[^"]*"')
+
+
+def _namespace(tag):
+    return tag[1:tag.index('}')] if tag[:1] == '{' else None
+
+
+class _Namespace(object):
+    """A namespace declaration of the tree, before unused ones are cleaned up
+    """
+    __slots__ = ('prefix', 'href', 'rank')
+
+    def __init__(self, prefix, href, rank):
+        self.prefix = prefix
+        self.href = href
+        # the nearest declaration has the highest rank
+        self.rank = rank
+
+
+def _lookup(scope, href, attribute=False):
+    """Returns the nearest declaration of <href> in <scope>, like libxml2 does
+    """
+    found = None
+    for namespace in scope.values():
+        if namespace.href != href or (attribute and namespace.prefix is None):
+            continue
+        if found is None or namespace.rank > found.rank:
+            found = namespace
+    return found
+
+
+def is_clean(obj, memo=None):
+    """Tells whether the element of <obj> would be clean (see pysxm.is_clean),
+    without building it. <memo> keeps the answers given for the objects of a tree
+    """
+    if memo is not None:
+        known = memo.get(id(obj))
+        if known is not None:
+            return known[1]
+    plan = SerializationPlan.get(obj.__class__)
+    if not plan.complex:
+        clean = obj.value is not None and stringify(obj.value) is not None
+    else:
+        clean = _has_children(obj, plan, True, memo)
+    if memo is not None:
+        # the object is kept so that its id isn't reused
+        memo[id(obj)] = (obj, clean)
+    return clean
+
+
+def _has_children(obj, plan, clean=False, memo=None):
+    """Tells whether the element of <obj> has children.
+    With <clean>, each of its lists must also have a clean member
+    """
+    has_children = False
+    for name, tag, kind in plan.fields(obj):
+        attr = getattr(obj, name, None)
+        if not attr and attr != 0:
+            continue
+        if kind is None:
+            kind = value_handler(attr)[0]
+        if kind is LIST:
+            if clean and _first_clean(name, attr, iter(attr), memo) is None:
+                return False
+            has_children = True
+        elif kind is TEXT or (not has_children and is_clean(attr, memo)):
+            has_children = True
+        if has_children and not clean:
+            return True
+    return has_children
+
+
+def _first_clean(name, values, members, memo=None):
+    """Consumes <members> up to the first clean one and returns it
+    """
+    for value in members:
+        check_list_value(name, values, value)
+        if is_clean(value, memo):
+            return value
+    return None
+
+
+def _members(obj, plan):
+    """Yields the objects of the child elements of <obj>, clean or not
+    """
+    for name, tag, kind in plan.fields(obj):
+        attr = getattr(obj, name, None)
+        if not attr and attr != 0:
+            continue
+        if kind is None:
+            kind = value_handler(attr)[0]
+        if kind is LIST:
+            for value in attr:
+                yield value
+        elif kind is not TEXT:
+            yield attr
+
+
+def _children(obj, plan, memo=None):
+    """Yields the objects of the child elements of <obj> kept in the tree
+    """
+    for member in _members(obj, plan):
+        if is_clean(member, memo):
+            yield member
+
+
+def _references(obj, plan, scope):
+    """Yields the namespace declarations referenced by the tag and attributes of the element of <obj>
+    """
+    namespace = plan.factory_of(obj).namespace
+    if namespace:
+        yield _lookup(scope, namespace)
+    for key in obj.attrib or ():
+        if key[:1] == '{':
+            yield _lookup(scope, _namespace(key), attribute=True)
+
+
+def _xmlfile_order(nsmap):
+    """Returns the prefixes of <nsmap> in the order etree.xmlfile declares them
+    """
+    return sorted(nsmap, key=lambda prefix: (prefix is not None, (prefix or '').encode('utf-8')))
+
+
+class _Output(object):
+    """Forwards what xmlfile writes to <output> or keeps it aside while capturing.
+    With a <buffer_size>, writes are gathered into chunks of about that many bytes
+    """
+
+    def __init__(self, output, buffer_size=0):
+        self.output = output
+        self.buffer_size = buffer_size
+        self.captured = None
+        self.pending, self.pending_size = [], 0
+
+    def write(self, data):
+        if self.captured is not None:
+            self.captured.append(bytes(data))
+            return
+        if not self.buffer_size:
+            self.output.write(data)
+            return
+        self.pending.append(bytes(data))
+        self.pending_size += len(data)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.output.write(b''.join(self.pending))
+            self.pending, self.pending_size = [], 0
+
+
+class _OrderedElement(object):
+    """Element context of etree.xmlfile declaring its namespaces in the order of <nsmap>,
+    as the tree does, instead of sorting them
+    """
+
+    def __init__(self, xf, output, tag, attrib, nsmap):
+        self.xf, self.output, self.nsmap = xf, output, nsmap
+        self.element = xf.element(tag, attrib, nsmap)
+
+    def __enter__(self):
+        self.xf.flush()
+        self.output.captured = []
+        try:
+            self.element.__enter__()
+            self.xf.flush()
+            start = b''.join(self.output.captured)
+        finally:
+            self.output.captured = None
+        begin = end = start.index(b' xmlns')
+        declarations = {}
+        match = _declaration.match(start, end)
+        while match:
+            declarations[match.group(1)] = match.group(0)
+            end = match.end()
+            match = _declaration.match(start, end)
+        ordered = [declarations[prefix.encode('utf-8') if prefix is not None else None]
+                   for prefix in self.nsmap]
+        self.output.write(start[:begin] + b''.join(ordered) + start[end:])
+
+    def __exit__(self, *exc_info):
+        return self.element.__exit__(*exc_info)
+
+
+class StreamWriter(object):
+    """Writes objects through lxml incremental writer (etree.xmlfile), element by element.
+    No element tree is built, the output is the one of etree.tostring(obj.xml),
+    namespaces included, but when lxml would bind an element to a shadowed prefix.
+    The cleanliness and the namespaces of each object are looked ahead once, and forgotten
+    once its element is written or left out, so that memory depends on the depth of the tree
+    """
+
+    def __init__(self, xf, output):
+        self.xf = xf
+        # where <xf> writes to, used for the few elements xmlfile can't write
+        self.output = output
+        self.ranks = itertools.count()
+        self.clean, self.namespaces = {}, {}
+
+    def write(self, obj):
+        self.clean, self.namespaces = {}, {}
+        plan = SerializationPlan.get(obj.__class__)
+        if not plan.complex or not _has_children(obj, plan, memo=self.clean):
+            # a single element
+            self.xf.write(obj.xml)
+            return
+        self._write(obj, plan, {}, None)
+
+    def write_records(self, records, tag, nsmap=None, attrib=None, chunk_size=1000):
+        """Writes the clean <records> as the children of a <tag> root element.
+        The root declares all of <nsmap>, records aren't looked ahead.
+        <output> is flushed every <chunk_size> records
+        """
+        factory = ElementFactory.get(nsmap=nsmap)
+        records = iter(records)
+        first = _first_clean('records', records, records)
+        if first is None:
+            self.xf.write(factory.element(tag, attrib=attrib))
+            return
+        scope = self._scope(factory, {}, None)[1]
+        with self._element(factory.qualify(tag), attrib, factory.nsmap):
+            self._write(first, SerializationPlan.get(first.__class__), scope, factory)
+            count = 1
+            for record in records:
+                check_list_value('records', records, record)
+                # records aren't kept once written
+                self.clean, self.namespaces = {}, {}
+                if not is_clean(record, self.clean):
+                    continue
+                self._write(record, SerializationPlan.get(record.__class__), scope, factory)
+                count += 1
+                if count % chunk_size == 0:
+                    self.xf.flush()
+                    self.output.flush()
+
+    def _write(self, obj, plan, scope, parent_factory):
+        """Writes the element of <obj>.
+        <scope> maps prefixes to the namespaces declared by its ancestors
+        """
+        xf = self.xf
+        factory = plan.factory_of(obj)
+        tag = plan.tag_of(obj, factory)
+        attrib = obj.attrib or None
+        declared, scope = self._scope(factory, scope, parent_factory)
+        nsmap = self._declarations(obj, plan, declared, scope) if declared else None
+        with self._element(tag, attrib, nsmap):
+            if plan.complex:
+                self._write_children(obj, plan, scope, factory)
+            else:
+                xf.write(stringify(obj.value))
+        self.clean.pop(id(obj), None)
+        self.namespaces.pop(id(obj), None)
+
+    def _write_children(self, obj, plan, scope, factory):
+        xf = self.xf
+        for name, subtag, kind in plan.fields(obj, factory):
+            attr = getattr(obj, name, None)
+            if not attr and attr != 0:
+                continue
+            if kind is None:
+                kind, converter = value_handler(attr)
+            else:
+                converter = stringify
+            if kind is TEXT:
+                with xf.element(subtag):
+                    xf.write(attr if converter is None else _objectify_text(converter(attr)))
+            elif kind is LIST:
+                self._write_list(name, subtag, attr, scope, factory)
+            elif is_clean(attr, self.clean):
+                self._write(attr, SerializationPlan.get(attr.__class__), scope, factory)
+            else:
+                self._forget(attr)
+
+    def _element(self, tag, attrib, nsmap):
+        if nsmap and len(nsmap) > 1 and list(nsmap) != _xmlfile_order(nsmap):
+            return _OrderedElement(self.xf, self.output, tag, attrib, nsmap)
+        return self.xf.element(tag, attrib, nsmap)
+
+    def _write_list(self, name, tag, values, scope, factory):
+        clean = self.clean
+        members = iter(values)
+        for first in members:
+            check_list_value(name, values, first)
+            if is_clean(first, clean):
+                break
+            self._forget(first)
+        else:
+            self._write_empty(tag, scope)
+            return
+        with self.xf.element(tag):
+            self._write(first, SerializationPlan.get(first.__class__), scope, factory)
+            for value in members:
+                check_list_value(name, values, value)
+                if is_clean(value, clean):
+                    self._write(value, SerializationPlan.get(value.__class__), scope, factory)
+                else:
+                    self._forget(value)
+
+    def _forget(self, obj):
+        """Drops what was looked ahead about <obj>, left out of the tree, and its descendants
+        """
+        objects = [obj]
+        while objects:
+            obj = objects.pop()
+            known = self.clean.pop(id(obj), None)
+            self.namespaces.pop(id(obj), None)
+            plan = SerializationPlan.get(obj.__class__)
+            if not plan.complex:
+                continue
+            if self.namespaces:
+                # the namespaces of the elements below may be known
+                objects.extend(_members(obj, plan))
+            elif known is not None:
+                objects.extend(member for member in _members(obj, plan) if id(member) in self.clean)
+
+    def _write_empty(self, tag, scope):
+        # xmlfile only writes empty elements as <tag></tag>
+        namespace = _namespace(tag)
+        name = tag[tag.index('}') + 1:] if namespace else tag
+        declaration = _lookup(scope, namespace) if namespace else None
+        if declaration is not None and declaration.prefix:
+            name = '%s:%s' % (declaration.prefix, name)
+        self.xf.flush()
+        self.output.write(('<%s/>' % name).encode('utf-8'))
+
+    def _scope(self, factory, scope, parent_factory):
+        """Returns the namespaces declared by an element of <factory> and the scope of its children.
+        As in the tree, namespaces already declared by an ancestor aren't declared again,
+        the ones cleaned up later still shadow their prefix
+        """
+        if not factory.nsmap or factory is parent_factory:
+            return (), scope
+        rank = next(self.ranks)
+        declared = [_Namespace(prefix, href, (rank, -index))
+                    for index, (prefix, href) in enumerate(factory.nsmap.items())
+                    if _lookup(scope, href) is None]
+        if not declared:
+            return (), scope
+        scope = dict(scope)
+        scope.update((namespace.prefix, namespace) for namespace in declared)
+        return declared, scope
+
+    def _declarations(self, obj, plan, declared, scope):
+        """Returns the namespace map written on the element of <obj>:
+        the <declared> namespaces which are used, the others being cleaned up from the tree
+        """
+        used = set(_references(obj, plan, scope))
+        unknown = set(namespace for namespace in declared if namespace not in used)
+        if unknown:
+            # the ones referenced nowhere below are unused, the others are looked up
+            referenced = self._namespaces(obj, plan)
+            unknown = set(namespace for namespace in unknown if namespace.href in referenced)
+        if unknown:
+            self._uses(obj, plan, scope, unknown, used)
+        return dict((namespace.prefix, namespace.href) for namespace in declared
+                    if namespace in used) or None
+
+    def _uses(self, obj, plan, scope, wanted, found):
+        """Adds to <found> the <wanted> namespaces referenced below the element of <obj>,
+        <scope> being the one of its children. Returns whether all of them are found
+        """
+        if not plan.complex:
+            return False
+        for child in _children(obj, plan, self.clean):
+            child_plan = SerializationPlan.get(child.__class__)
+            children = self._scope(child_plan.factory_of(child), scope, plan.factory_of(obj))[1]
+            found.update(_references(child, child_plan, children))
+            if wanted <= found or self._uses(child, child_plan, children, wanted, found):
+                return True
+        return False
+
+    def _namespaces(self, obj, plan, parent_factory=None):
+        """Returns the namespaces referenced by the element of <obj> and its descendants, clean or not.
+        It's kept for the elements declaring namespaces they don't reference, which look it up again
+        """
+        known = self.namespaces.get(id(obj))
+        if known is not None:
+            return known[1]
+        factory = plan.factory_of(obj)
+        namespaces = set([factory.namespace]) if factory.namespace else set()
+        namespaces.update(_namespace(key) for key in obj.attrib or () if key[:1] == '{')
+        unreferenced = factory.nsmap and factory is not parent_factory and not namespaces.issuperset(
+            factory.nsmap.values())
+        if plan.complex:
+            for member in _members(obj, plan):
+                namespaces.update(self._namespaces(member, SerializationPlan.get(member.__class__), factory))
+        if unreferenced:
+            self.namespaces[id(obj)] = (obj, namespaces)
+        return namespaces
+
+
+@contextmanager
+def _open(target, compression=0, buffer_size=0, name=None):
+    """Yields the output of etree.xmlfile writing into <target>.
+    When instrumented, the time and the bytes written are recorded under <name>
+    """
+    recorder = instrumentation.recorder
+    output = target if hasattr(target, 'write') else io.open(target, 'wb')
+    written = output if recorder is None else CountingOutput(output)
+    stream = gzip.GzipFile(fileobj=written, mode='wb', compresslevel=compression) if compression else written
+    if recorder is not None:
+        start = timer()
+    try:
+        sink = _Output(stream, buffer_size)
+        yield sink
+        sink.flush()
+    finally:
+        if stream is not written:
+            stream.close()
+        if output is not target:
+            output.close()
+    if recorder is not None:
+        recorder.record(STREAM, name, timer() - start, written.size)
+
+
+def write(obj, target, compression=0):
+    """Streams the xml of <obj> into <target>: a path, a binary file object or any object
+    with a <write> method. <compression> is a gzip level, 0 means no compression
+    """
+    with _open(target, compression, name=obj.__class__.__name__) as sink:
+        with etree.xmlfile(sink) as xf:
+            StreamWriter(xf, sink).write(obj)
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        check_list_value('records', records, record)
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _root_tags(empty):
+    """Returns the start and end tags of the serialized <empty> element
+    """
+    name = re.match(br'<([^\s/>]+)', empty).group(1)
+    return empty[:-2] + b'>', b'</' + name + b'>'
+
+
+def _fragment(tag, nsmap, attrib, records):
+    """Returns the xml of the clean <records> as children of the root element, without its tags.
+    It's run by the worker processes of <write_records>
+    """
+    root = ElementFactory.get(nsmap=nsmap).element(tag, attrib=attrib)
+    empty = etree.tostring(root)
+    for record in records:
+        if is_clean(record):
+            root.append(record.xml)
+    content = etree.tostring(root)
+    if content == empty:
+        return b''
+    start, end = _root_tags(empty)
+    return content[len(start):-len(end)]
+
+
+def _imap(pool, function, tasks, window):
+    """Like pool.imap but with at most <window> pending tasks, <tasks> are consumed as needed
+    """
+    pending = collections.deque()
+    for args in tasks:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _write_parallel(sink, records, tag, nsmap, attrib, chunk_size, workers):
+    empty = etree.tostring(ElementFactory.get(nsmap=nsmap).element(tag, attrib=attrib))
+    start, end = _root_tags(empty)
+    tasks = ((tag, nsmap, attrib, chunk) for chunk in _chunks(records, chunk_size))
+    pool = multiprocessing.Pool(workers)
+    try:
+        started = False
+        for fragment in _imap(pool, _fragment, tasks, 2 * workers):
+            if not fragment:
+                continue
+            if not started:
+                sink.write(start)
+                started = True
+            sink.write(fragment)
+            sink.flush()
+        sink.write(end if started else empty)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_records(records, target, tag, nsmap=None, attrib=None, compression=0,
+                  chunk_size=1000, buffer_size=io.DEFAULT_BUFFER_SIZE, workers=0, validation=None):
+    """Streams an iterable of ComplexType <records> into <target> (see <write>), as the children
+    of a <tag> root element with <nsmap> and <attrib>. Records are consumed lazily and written
+    in chunks of <chunk_size> records, output being buffered up to <buffer_size> bytes.
+    With several <workers>, chunks are serialized by a pool of processes and written back
+    in order, records must then be picklable.
+    With a <validation> mode (see pysxm.validation), records are consumed in its context
+    and the ValidationReport is returned, restriction errors being reported by record index.
+    The stream is instrumented (see pysxm.instrument) under <tag>, the pool processes aren't
+    """
+    if validation is not None:
+        with ValidationReport(validation) as report:
+            write_records(report.records(records), target, tag, nsmap, attrib, compression,
+                          chunk_size, buffer_size, workers)
+        return report
+    with _open(target, compression, buffer_size, tag) as sink:
+        if workers > 1:
+            _write_parallel(sink, records, tag, nsmap, attrib, chunk_size, workers)
+            return
+        with etree.xmlfile(sink) as xf:
+            StreamWriter(xf, sink).write_records(records, tag, nsmap, attrib, chunk_size)
+
+
+class AppendWriter(object):
+    """Appends records to the root element of the document <path>, a <tag> element created
+    with <nsmap> and <attrib> if the file doesn't exist. The file is kept open: each record is
+    written over the closing tag of the root, written again after it, so that an append
+    costs the size of the record. Records are serialized as by <write_records>, the <nsmap>
+    must be the one of the root. Each append is flushed, and synced to the disk with <fsync>.
+    A document whose end was lost, by a crash during an append for instance, is recovered
+    when opened: it's cut after its last complete record, <recovered> being the bytes dropped
+    """
+
+    def __init__(self, path, tag, nsmap=None, attrib=None, fsync=False):
+        self.tag, self.nsmap, self.attrib = tag, nsmap, attrib
+        self.fsync = fsync
+        self.recovered = 0
+        if not os.path.exists(path) or not os.path.getsize(path):
+            start, end = _root_tags(etree.tostring(ElementFactory.get(nsmap=nsmap).element(tag, attrib=attrib)))
+            with io.open(path, 'wb') as fp:
+                fp.write(start + end)
+        self.file = io.open(path, 'r+b')
+        try:
+            self.end, self.offset = self._open()
+        except Exception:
+            self.file.close()
+            raise
+
+    def _open(self):
+        """Returns the closing tag of the root and its offset, recovering the end of the document if needed
+        """
+        fp = self.file
+        match = re.search(br'<([^\s/>?!]+)', fp.read(4096))
+        if match is None:
+            raise ValueError('%s has no root element' % fp.name)
+        end = b'</' + match.group(1) + b'>'
+        size = fp.seek(0, io.SEEK_END)
+        fp.seek(max(0, size - len(end) - 256))
+        tail = fp.read()
+        stripped = tail.rstrip()
+        if stripped.endswith(end):
+            return end, size - len(tail) + len(stripped) - len(end)
+        if stripped.endswith(b'/>') and _complete_length(fp) is None:
+            # an empty root element, opened
+            offset = size - len(tail) + len(stripped) - 2
+            self._write_at(offset, b'>' + end)
+            return end, offset + 1
+        offset = _complete_length(fp)
+        if offset is None:
+            raise ValueError('%s can\'t be recovered, its root element is incomplete' % fp.name)
+        self.recovered = size - offset
+        self._write_at(offset, end)
+        return end, offset
+
+    def _write_at(self, offset, data):
+        fp = self.file
+        fp.seek(offset)
+        fp.write(data)
+        fp.truncate()
+        fp.flush()
+        if self.fsync:
+            os.fsync(fp.fileno())
+
+    def append(self, record):
+        self.extend((record,))
+
+    def extend(self, records):
+        """Appends the clean <records>, written at once
+        """
+        data = _fragment(self.tag, self.nsmap, self.attrib, records)
+        if not data:
+            return
+        self._write_at(self.offset, data + self.end)
+        self.offset += len(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _complete_length(fp):
+    """Returns the length of the start of the document <fp> ending with the last complete child
+    of its root element, the root being closed. None when the root element is complete
+    """
+    state = dict(depth=0, offset=None, pending=None, closed=False)
+    parser = expat.ParserCreate()
+
+    def token(*args):
+        # the start of the token following a complete child
+        if state['pending'] is not None:
+            state['offset'], state['pending'] = parser.CurrentByteIndex, None
+
+    def start(*args):
+        token()
+        state['depth'] += 1
+        if state['depth'] == 1:
+            state['pending'] = parser.CurrentByteIndex
+
+    def finish(*args):
+        token()
+        state['depth'] -= 1
+        if state['depth'] == 1:
+            state['pending'] = parser.CurrentByteIndex
+        elif not state['depth']:
+            state['closed'] = True
+
+    parser.StartElementHandler, parser.EndElementHandler = start, finish
+    parser.CharacterDataHandler = parser.CommentHandler = parser.ProcessingInstructionHandler = token
+    fp.seek(0)
+    try:
+        for chunk in iter(lambda: fp.read(io.DEFAULT_BUFFER_SIZE), b''):
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+    except expat.ExpatError:
+        pass
+    if state['closed']:
+        return None
+    if state['pending'] is not None:
+        # nothing was read after the last child, it ends with the first '>' of its end tag
+        fp.seek(state['pending'])
+        head = fp.read(io.DEFAULT_BUFFER_SIZE)
+        index = head.find(b'>')
+        if index >= 0:
+            state['offset'] = state['pending'] + index + 1
+    return state['offset']
@@ -0,0 +1,119 @@
+# Copyright (c) 2017 Josue Kouka
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (Pysxm), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, absolute_import
+
+import collections
+import threading
+
+# validation modes: restriction errors are raised, collected into a report or not checked at all
+STRICT, COLLECT, OFF = 'strict', 'collect', 'off'
+
+
+class _Context(threading.local):
+    # the report of the current thread, None when validation is strict
+    report = None
+
+
+context = _Context()
+
+Violation = collections.namedtuple('Violation', ('record', 'path', 'value', 'message'))
+
+
+def current_report():
+    """Returns the report of the validation context of the current thread, if any
+    """
+    return context.report
+
+
+class ValidationReport(object):
+    """Restriction errors of a batch, as a list of Violation(record, path, value, message).
+    Used as a context manager, it sets the validation <mode> of the current thread:
+    with COLLECT restriction errors are reported instead of raised, the values being set anyway,
+    with OFF restrictions aren't checked. <record> is the index of the record being built
+    (see <records>), <path> is <tagname>/<field> for descriptors and <tagname> for simple types
+    """
+
+    def __init__(self, mode=COLLECT):
+        if mode not in (STRICT, COLLECT, OFF):
+            raise ValueError('unknown validation mode <%s>' % mode)
+        self.mode = mode
+        self.errors = []
+        self.record = None
+        self._previous = []
+
+    def __enter__(self):
+        self._previous.append(current_report())
+        # strict is the default, raising whatever the enclosing context
+        context.report = self if self.mode != STRICT else None
+        return self
+
+    def __exit__(self, *exc_info):
+        context.report = self._previous.pop()
+
+    def __len__(self):
+        return len(self.errors)
+
+    def __iter__(self):
+        return iter(self.errors)
+
+    def __str__(self):
+        return '%d restriction errors' % len(self.errors)
+
+    def add(self, path, value, error):
+        self.errors.append(Violation(self.record, path, value, '%s' % error))
+
+    def records(self, iterable):
+        """Returns an iterator over <iterable> numbering the records, the errors raised
+        while one is built (by a generator for instance) being reported with its index
+        """
+        return _Records(self, iterable)
+
+    def as_dicts(self):
+        return [dict(error._asdict()) for error in self.errors]
+
+
+class _Records(object):
+
+    def __init__(self, report, iterable):
+        self.report = report
+        self.iterator = iter(iterable)
+        self.index = -1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.index += 1
+        self.report.record = self.index
+        return next(self.iterator)
+
+    next = __next__
+
+
+def validation(mode=COLLECT):
+    """Returns a ValidationReport to use as a context manager, e.g:
+
+        with validation() as report:
+            users = [User(**row) for row in report.records(rows)]
+    """
+    return ValidationReport(mode)
+
+
+__all__ = ['COLLECT', 'OFF', 'STRICT', 'ValidationReport', 'Violation', 'current_report', 'validation']
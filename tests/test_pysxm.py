@@ -69,6 +69,7 @@ class NextCycle(TimeType):
 class BirthInfo(ComplexType):
 
     _sequence = ('city', 'country', 'date')
+    _types = {'date': BirthDate}
 
     def __init__(self, data):
         self.city = data['birth_city']
@@ -79,6 +80,7 @@ class BirthInfo(ComplexType):
 class Identity(ComplexType):
 
     sequence = ('first_name', 'last_name', 'birth_info')
+    _types = {'birth_info': BirthInfo}
 
     def __init__(self, data):
         self.first_name = data['first_name']
@@ -89,6 +91,7 @@ class Identity(ComplexType):
 class User(ComplexType):
 
     sequence = ('username', 'identity', 'last_login')
+    _types = {'identity': Identity, 'last_login': LastLogin}
 
     def __init__(self, data):
         self.username = data['username']
@@ -466,3 +469,1089 @@ def test_list_subelement():
     for sp in p.getchildren():
         assert sp.name in ("A", "B")
         assert sp.kind in (2, 5)
+
+
+def test_deannotate_once_per_document(monkeypatch):
+    from pysxm import pysxm as core
+
+    calls = []
+    deannotate = core.xobject.deannotate
+
+    def counting_deannotate(element, *args, **kwargs):
+        calls.append(element.tag)
+        return deannotate(element, *args, **kwargs)
+
+    monkeypatch.setattr(core.xobject, 'deannotate', counting_deannotate)
+
+    class Node(ComplexType):
+
+        def __init__(self, depth):
+            self.depth = depth
+            if depth:
+                self.node = Node(depth - 1)
+
+    xml = Node(5).xml
+    assert calls == ['node']
+    assert xml.node.node.node.node.node.depth == 0
+    assert 'xsi' not in xml.nsmap
+
+
+def test_empty_subtree_pruning():
+
+    class Empty(SimpleType):
+
+        def check_restriction(self, value):
+            pass
+
+    class Box(ComplexType):
+        _sequence = ('label', 'items', 'count')
+
+        def __init__(self, label, items=None, count=None):
+            self.label = label
+            self.items = items if items is not None else []
+            self.count = count
+
+    class Shelf(ComplexType):
+        _sequence = ('boxes', 'spare')
+
+        def __init__(self, boxes, spare):
+            self.boxes = boxes
+            self.spare = spare
+
+    full = Box('full', [Empty('a'), Empty(None)], 0)
+    hollow = Box('hollow', [Empty(None)])
+    shelf = Shelf([full, hollow, Box('none')], Box('spare', [Empty('b')]))
+    xml = shelf.xml
+    # a box whose <items> ends up empty is dropped with its whole subtree,
+    # an empty list is skipped like any other empty value
+    assert [box.label for box in xml.boxes.getchildren()] == ['full', 'none']
+    assert len(xml.boxes.box['items'].getchildren()) == 1
+    assert xml.boxes.box.count == 0
+    assert xml.box.label == 'spare'
+    # the root element itself is never pruned
+    root = Box('root', [Empty(None)]).xml
+    assert root.label == 'root'
+    assert root['items'].getchildren() == []
+
+
+def test_element_factory():
+    from lxml import etree
+    from pysxm.pysxm import ElementFactory
+
+    nsmap = {'sp': 'http://southpark/xml/'}
+    factory = ElementFactory.get(nsmap=nsmap)
+    assert ElementFactory.get(nsmap=dict(nsmap)) is factory
+    assert ElementFactory.get(nsmap={'sp': 'http://other/'}) is not factory
+    nsmap['sp'] = 'http://other/'
+    assert factory.nsmap == {'sp': 'http://southpark/xml/'}
+    assert factory.qualify('city') == '{http://southpark/xml/}city'
+    assert ElementFactory.get().qualify('city') == 'city'
+    assert ElementFactory.get(namespace='http://x/').qualify('city') == '{http://x/}city'
+    # the factories and their tags are remembered up to a bound
+    factories = dict(ElementFactory._factories)
+    for index in range(2 * ElementFactory.max_factories):
+        namespace = 'http://generated/%d' % index
+        assert ElementFactory.get(nsmap={'g': namespace}).qualify('item') == '{%s}item' % namespace
+    assert len(ElementFactory._factories) <= ElementFactory.max_factories
+    ElementFactory._factories.clear()
+    ElementFactory._factories.update(factories)
+    for index in range(2 * factory.max_tags):
+        assert factory.qualify('tag%d' % index) == '{http://southpark/xml/}tag%d' % index
+    assert len(factory.tags) == factory.max_tags
+
+    person = factory.element('person', attrib={'id': '1'})
+    factory.subelement(person, 'age', 10)
+    factory.subelement(person, 'alive', True)
+    factory.subelement(person, 'score', 1.5)
+    assert person.age == 10
+    assert person.score == 1.5
+    assert etree.tostring(person) == (
+        b'<sp:person xmlns:sp="http://southpark/xml/" id="1"><sp:age>10</sp:age>'
+        b'<sp:alive>true</sp:alive><sp:score>1.5</sp:score></sp:person>')
+
+
+def test_serialization_plan():
+    from pysxm.pysxm import NODE, TEXT, SerializationPlan
+
+    class Point(ComplexType):
+        _sequence = ('x', 'y')
+
+        def __init__(self, x, y):
+            self.x = x
+            self.y = y
+
+    point = Point(1, 2)
+    assert [child.tag for child in point.xml.getchildren()] == ['x', 'y']
+    plan = SerializationPlan.get(Point)
+    assert SerializationPlan.get(Point) is plan
+    assert plan.entries == (('x', 'x', None), ('y', 'y', None))
+
+    # reassigning a class attribute compiles a new plan
+    Point._sequence = ('y', 'x')
+    assert [child.tag for child in point.xml.getchildren()] == ['y', 'x']
+    Point.nsmap = {'geo': 'http://geo/'}
+    assert point.xml.tag == '{http://geo/}point'
+    assert point.xml.x.tag == '{http://geo/}x'
+    assert SerializationPlan.get(Point) is not plan
+    # as is updating its namespace map in place
+    Point.nsmap['geo'] = 'http://geo/v2/'
+    assert point.xml.x.tag == '{http://geo/v2/}x'
+
+    # an instance can still have its own sequence
+    point._sequence = ('x',)
+    assert [child.tag for child in point.xml.getchildren()] == ['{http://geo/v2/}x']
+
+    class Pixel(Point):
+        nsmap = None
+        sequence = ['x', 'y']
+
+    pixel = Pixel(1, 2)
+    assert [child.tag for child in pixel.xml.getchildren()] == ['x', 'y']
+    # a sequence list changed in place is seen, as is the sequence of an instance
+    Pixel.sequence.reverse()
+    assert [child.tag for child in pixel.xml.getchildren()] == ['y', 'x']
+    pixel.sequence = ('x',)
+    assert [child.tag for child in pixel.xml.getchildren()] == ['x']
+
+    class Game(DataComplexType):
+        platform = XSimpleType('platform', ['xboxone', 'xboxx'], lambda v, av: v in av)
+        released = XDateType('released')
+
+    game = Game(name='halo', platform='xboxone', released='2001-11-15')
+    assert game.xml.platform == 'xboxone'
+    assert game.xml.released == '2001-11-15'
+    entries = SerializationPlan.get(Game).fields(game)
+    assert dict((name, kind) for name, tag, kind in entries) == {
+        'name': None, 'platform': NODE, 'released': TEXT}
+
+
+def test_value_handlers():
+    import enum
+    import uuid
+    from decimal import Decimal
+    from pysxm import register_type, unregister_type
+    from pysxm.pysxm import LIST, NODE, TEXT, _dispatch, is_safe_type, value_handler
+    from pysxm.stream import write
+
+    class Status(enum.Enum):
+        ACTIVE = 'active'
+
+    class Level(enum.Enum):
+        GOLD = 3
+
+    class Account(ComplexType):
+        _sequence = ('id', 'status', 'balance', 'verified', 'colors')
+
+        def __init__(self, id, status, balance, verified, colors):
+            self.id = id
+            self.status = status
+            self.balance = balance
+            self.verified = verified
+            self.colors = colors
+
+    assert value_handler('text') == (TEXT, None)
+    assert value_handler([]) == (LIST, None)
+    assert value_handler(()) == (LIST, None)
+    assert value_handler(LightColor('red'))[0] is NODE
+    assert _dispatch[LightColor] == (NODE, None)
+    assert is_safe_type(10) and is_safe_type(Decimal('1.5')) and is_safe_type('1')
+    assert not is_safe_type(LightColor('red'))
+    assert not is_safe_type([1])
+
+    account_id = uuid.UUID(int=1)
+    # unknown types are rendered as they always were
+    assert value_handler(account_id)[0] is NODE
+    try:
+        register_type(uuid.UUID)
+        register_type(enum.Enum, lambda e: e.value)
+        assert value_handler(account_id)[0] is TEXT
+        account = Account(account_id, Status.ACTIVE, Decimal('10.50'), False,
+                          (LightColor('red'), LightColor('green')))
+        xml = account.xml
+        assert xml.id == '00000000-0000-0000-0000-000000000001'
+        assert xml.status == 'active'
+        assert xml.balance.text == '10.50'
+        assert xml.verified.text == 'false'
+        assert [color.text for color in xml.colors.getchildren()] == ['red', 'green']
+        # the values returned by a converter are rendered as text
+        account = Account(Level.GOLD, Status.ACTIVE, None, True, ())
+        assert account.xml.id.text == '3'
+        assert account.xml.verified.text == 'true'
+        stream = io.BytesIO()
+        write(account, stream)
+        assert b'<id>3</id><status>active</status><verified>true</verified>' in stream.getvalue()
+    finally:
+        unregister_type(uuid.UUID)
+        unregister_type(enum.Enum)
+    assert value_handler(account_id)[0] is NODE
+
+
+def test_stream_write(tmpdir):
+    import gzip
+    from lxml import etree
+    from pysxm.stream import StreamWriter, _Output, write
+
+    class Color(LightColor):
+        nsmap = {'c': 'http://colors/'}
+
+    class Palette(ComplexType):
+        nsmap = {'p': 'http://palette/', 'c': 'http://colors/', 'unused': 'http://unused/'}
+        attrib = {'name': 'a "warm" & <bright> palette'}
+        sequence = ('title', 'colors', 'spare', 'palette')
+
+        def __init__(self, colors, palette=None):
+            self.title = 'résumé'
+            self.colors = [Color(color) for color in colors]
+            self.spare = []
+            self.palette = palette
+
+    class Chunks(object):
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, data):
+            self.chunks.append(bytes(data))
+
+    data = {'username': 'token', 'first_name': 'token', 'last_name': 'black',
+            'birth_city': 'south park', 'birth_country': 'us', 'birth_date': '2000-01-01',
+            'last_login': '2018-03-21T10:00:00'}
+    for obj in (User(data), Palette(['red', 'green'], Palette(['orange'])), Palette([]),
+                LightColor('red')):
+        expected = etree.tostring(obj.xml)
+        output = io.BytesIO()
+        write(obj, output)
+        assert output.getvalue() == expected
+        chunks = Chunks()
+        write(obj, chunks)
+        assert b''.join(chunks.chunks) == expected
+
+    palette = Palette(['red', 'green'])
+    path = tmpdir.join('palette.xml')
+    palette.save(str(path), pretty_print=False)
+    saved = path.read_binary()
+    write(palette, str(path))
+    assert path.read_binary() == saved
+    write(palette, str(path), compression=6)
+    with gzip.open(str(path)) as fp:
+        assert fp.read() == saved
+
+    # what's looked ahead is forgotten once written, lists are streamed in constant memory
+    palette = Palette(['red', 'green'], Palette([], Palette(['orange'])))
+    output = io.BytesIO()
+    sink = _Output(output)
+    with etree.xmlfile(sink) as xf:
+        writer = StreamWriter(xf, sink)
+        writer.write(palette)
+    assert output.getvalue() == etree.tostring(palette.xml)
+    assert not writer.clean and not writer.namespaces
+
+
+def test_stream_write_records():
+    from lxml import etree
+    from pysxm.pysxm import ElementFactory
+    from pysxm.stream import write_records
+
+    class Item(ComplexType):
+        nsmap = {'i': 'http://items/'}
+
+        def __init__(self, index):
+            self.sku = 'sku-%d' % index
+            self.quantity = index
+
+    class Game(DataComplexType):
+        nsmap = {'e': 'http://export/'}
+
+    class Chunks(object):
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, data):
+            self.chunks.append(bytes(data))
+
+    def records(size):
+        for index in range(size):
+            yield Item(index)
+            yield Game(name='game %d' % index)
+            yield Game()
+
+    nsmap = {'e': 'http://export/', 'i': 'http://items/'}
+    root = ElementFactory.get(nsmap=nsmap).element('export', attrib={'version': '1'})
+    for record in records(50):
+        if record.xml.countchildren():
+            root.append(record.xml)
+    output = Chunks()
+    write_records(records(50), output, 'export', nsmap, {'version': '1'},
+                  chunk_size=10, buffer_size=256)
+    assert b''.join(output.chunks) == etree.tostring(root)
+    assert len(output.chunks) > 10
+    assert all(len(chunk) < 1024 for chunk in output.chunks)
+
+    output = io.BytesIO()
+    write_records(iter([]), output, 'export', nsmap)
+    assert output.getvalue() == b'<e:export xmlns:e="http://export/" xmlns:i="http://items/"/>'
+    with pytest.raises(Exception):
+        write_records(['oops'], io.BytesIO(), 'export')
+
+
+def test_stream_write_records_in_parallel():
+    from pysxm.stream import write_records
+
+    def records(size):
+        for index in range(size):
+            yield User({'username': 'user-%d' % index, 'first_name': 'token', 'last_name': 'black',
+                        'birth_city': 'south park', 'birth_country': 'us',
+                        'birth_date': '2000-01-01', 'last_login': '2018-03-21T10:00:00'})
+            yield LightColor('red')
+
+    for size, nsmap in ((25, {'u': 'http://users/'}), (3, None), (0, {'u': 'http://users/'})):
+        serial, parallel = io.BytesIO(), io.BytesIO()
+        write_records(records(size), serial, 'users', nsmap, {'count': str(size)}, chunk_size=4)
+        write_records(records(size), parallel, 'users', nsmap, {'count': str(size)},
+                      chunk_size=4, workers=3)
+        assert parallel.getvalue() == serial.getvalue()
+
+
+def test_unmarshalling(tmpdir):
+    from lxml import etree
+    from pysxm.parse import from_xml
+
+    class Game(DataComplexType):
+        nsmap = {'g': 'http://games/'}
+        platform = ListXSimpleType(restriction=['xboxone', 'ps4'])
+        released = XDateType('released')
+        _types = {'players': int, 'online': bool}
+
+    class Library(ComplexType):
+        nsmap = {'l': 'http://library/'}
+        attrib = {'version': '1'}
+        _sequence = ('owner', 'colors', 'games', 'favorite')
+        _types = {'colors': [LightColor], 'games': [Game], 'favorite': Game}
+
+        def __init__(self, owner, colors, games):
+            self.owner = owner
+            self.colors = [LightColor(color) for color in colors]
+            self.games = games
+            self.favorite = games[0]
+
+    data = {'username': 'token', 'first_name': 'token', 'last_name': 'black',
+            'birth_city': 'south park', 'birth_country': 'us', 'birth_date': '2000-01-01',
+            'last_login': '2018-03-21T10:00:00'}
+    user = User(data)
+    path = tmpdir.join('user.xml')
+    user.save(str(path))
+    parsed = User.parse(str(path))
+    assert parsed.identity.birth_info.date.value == '2000-01-01'
+    assert parsed.last_login.value == '2018-03-21T10:00:00'
+    assert etree.tostring(parsed.xml) == etree.tostring(user.xml)
+
+    games = [Game(name='halo', platform='xboxone', released='2001-11-15', players=4, online=True),
+             Game(name='gt', platform='ps4', released='1997-12-23', players=1, online=False)]
+    library = Library('token', ['red', 'green'], games)
+    xml = etree.tostring(library.xml)
+    parsed = from_xml(Library, xml.decode('utf-8'))
+    assert [color.value for color in parsed.colors] == ['red', 'green']
+    assert parsed.games[0].players == 4 and parsed.games[0].online is True
+    assert parsed.games[1].online is False
+    assert parsed.favorite.platform.value == 'xboxone'
+    assert etree.tostring(parsed.xml) == xml
+
+    parsed = Library.from_xml(xml.replace(b'version="1"', b'version="2"'))
+    assert parsed.attrib == {'version': '2'}
+
+    # restrictions are checked while parsing
+    with pytest.raises(ValueError):
+        Library.from_xml(xml.replace(b'>green<', b'>blue<'))
+    with pytest.raises(ValueError):
+        Library.from_xml(xml.replace(b'>ps4<', b'>wii<'))
+    with pytest.raises(ValueError) as excinfo:
+        Library.from_xml(xml.replace(b'l:owner', b'l:unknown').replace(b'<l:games>', b'<l:games><x/>'))
+    assert 'unexpected element <x>' in str(excinfo.value)
+    with pytest.raises(ValueError) as excinfo:
+        User.from_xml(xml)
+    assert '<user> expected, got <library>' in str(excinfo.value)
+
+    # booleans are the ones of xs:boolean
+    game = '<g:game xmlns:g="http://games/">%s</g:game>'
+    assert Game.from_xml(game % '<g:online>1</g:online>').online is True
+    assert Game.from_xml(game % '<g:online>0</g:online>').online is False
+    with pytest.raises(ValueError):
+        Game.from_xml(game % '<g:online>yes</g:online>')
+    # a text is parsed whatever the encoding of its declaration
+    text = '<?xml version="1.0" encoding="ISO-8859-1"?>\n' + game % '<g:name>pok\xe9mon</g:name>'
+    assert Game.from_xml(text).name == 'pok\xe9mon'
+
+    class Order(DataComplexType):
+        _types = {'billing': LightColor, 'shipping': LightColor}
+
+    with pytest.raises(ValueError) as excinfo:
+        Order.from_xml(b'<order/>')
+    assert 'both hold <lightcolor> elements' in str(excinfo.value)
+
+
+def test_iterparse():
+    from pysxm.stream import write_records
+
+    class Game(DataComplexType):
+        platform = ListXSimpleType(restriction=['xboxone', 'ps4'])
+        _types = {'players': int}
+
+    class Color(LightColor):
+        pass
+
+    output = io.BytesIO()
+    output.write(b'<feed>')
+    for batch in range(3):
+        write_records((Game(name='game %d' % index, platform='ps4', players=index)
+                       for index in range(batch * 10, batch * 10 + 10)), output, 'batch')
+    output.write(b'<color>purple</color></feed>')
+    source = output.getvalue()
+
+    games = Game.iterparse(io.BytesIO(source))
+    assert [game.players for game in games] == list(range(30))
+    assert next(Game.iterparse(io.BytesIO(source))).platform.value == 'ps4'
+
+    source = source.replace(b'<platform>ps4</platform>', b'<platform>wii</platform>')
+    with pytest.raises(ValueError):
+        list(Game.iterparse(io.BytesIO(source)))
+    games = list(Game.iterparse(io.BytesIO(source), validate=False))
+    assert [game.platform.value for game in games] == ['wii'] * 30
+    with pytest.raises(ValueError):
+        list(Color.iterparse(io.BytesIO(source)))
+    assert [color.value for color in Color.iterparse(io.BytesIO(source), validate=False)] == ['purple']
+
+
+def test_date_parsing():
+    import datetime
+    from dateutil.parser import parse as dateutil_parse
+    from pysxm import ext
+    from pysxm.ext import DateParser, configure_dates
+
+    parser = DateParser()
+    for value in ('2018-03-21', '2018-03-21T10:00', '2018-03-21 10:00:05.5',
+                  '2018-03-21T10:00:05.123456Z', '2018-03-21T10:00:05-0530',
+                  '2018-03-21T10:00+00:00', '21 March 2018 10:00'):
+        parsed = dateutil_parse(value)
+        assert parser.isoformat(value) == parsed.isoformat()
+        assert parser.isoformat(value, 'date') == parsed.date().isoformat()
+        assert parser.isoformat(value, 'time') == parsed.time().isoformat()
+    assert parser.isoformat('10:30:05', 'time') == '10:30:05'
+
+    moment = datetime.datetime(2018, 3, 21, 10, 0, 5)
+    assert LastLogin(moment).value == '2018-03-21T10:00:05'
+    assert BirthDate(moment.date()).value == '2018-03-21'
+    assert LastLogin(moment.date()).value == '2018-03-21T00:00:00'
+    assert NextCycle(moment.time()).value == '10:00:05'
+    with pytest.raises(TypeError):
+        LastLogin(20180321)
+
+    parser = DateParser(strict=True, cache_size=2)
+    assert parser.isoformat('2018-03-21T10:00') == '2018-03-21T10:00:00'
+    with pytest.raises(ValueError):
+        parser.isoformat('21 March 2018')
+    parser.isoformat('2018-03-22')
+    parser.isoformat('2018-03-21T10:00')
+    parser.isoformat('2018-03-23')
+    assert list(parser.cache) == [('2018-03-21T10:00', None), ('2018-03-23', None)]
+    # the cache is shared by threads
+    from concurrent.futures import ThreadPoolExecutor
+    days = ['2018-03-%02d' % (index % 28 + 1) for index in range(2000)]
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(parser.isoformat, days)) == [day + 'T00:00:00' for day in days]
+    assert len(parser.cache) == 2
+
+    class Game(DataComplexType):
+        released = XDateType('released')
+
+    try:
+        configure_dates(strict=True, cache_size=16)
+        assert Game(released='2001-11-15T00:00:00Z').released == '2001-11-15'
+        assert list(ext.date_parser.cache) == [('2001-11-15T00:00:00Z', 'date')]
+        with pytest.raises(ValueError):
+            Game(released='Nov 15 2001')
+    finally:
+        configure_dates()
+    assert Game(released='Nov 15 2001').released == '2001-11-15'
+
+
+def test_date_columns():
+    import datetime
+    from pysxm.ext import InvalidDates, date_parser, normalize_dates
+
+    column = ['2018-03-21T10:00:05', datetime.date(2018, 3, 22), '2018-03-21T10:00:05', '23 March 2018']
+    assert normalize_dates(column) == ['2018-03-21T10:00:05', '2018-03-22T00:00:00',
+                                       '2018-03-21T10:00:05', '2018-03-23T00:00:00']
+    assert normalize_dates(column, 'date') == ['2018-03-21', '2018-03-22', '2018-03-21', '2018-03-23']
+    # same instant, different offsets
+    instants = [date_parser.parse_iso(instant, None) for instant in ['2020-01-01T23:00-05:00', '2020-01-02T04:00Z']]
+    assert normalize_dates(instants, 'date') == ['2020-01-01', '2020-01-02']
+
+    dates = BirthDate.from_column(column)
+    assert [date.value for date in dates] == ['2018-03-21', '2018-03-22', '2018-03-21', '2018-03-23']
+    assert dates[0].tagname == 'dateNaissance'
+    assert [time.value for time in NextCycle.from_column(column)][:2] == ['10:00:05', '00:00:00']
+
+    with pytest.raises(InvalidDates) as excinfo:
+        LastLogin.from_column(['2018-03-21', 'not a date', None, '2018-02-30', '2018-03-22'])
+    error = excinfo.value
+    assert sorted(error.errors) == [1, 2, 3]
+    assert isinstance(error.errors[2], TypeError)
+    assert [login and login.value for login in error.results] == [
+        '2018-03-21T00:00:00', None, None, None, '2018-03-22T00:00:00']
+    assert str(error).startswith('3 invalid dates (1: ')
+
+
+def test_concurrent_descriptor_namespaces():
+    from concurrent.futures import ThreadPoolExecutor
+    from lxml import etree
+    from pysxm.stream import write
+
+    def make_class(index):
+        return type(str('Item%d' % index), (DataComplexType,), {
+            'nsmap': {'i': 'http://items/%d' % index},
+            'code': XSimpleType('code', None, lambda v, av: True, tagname='code',
+                                nsmap={'c': 'http://codes/%d' % index}, attrib={'index': str(index)}),
+            'label': XSimpleType('label', None, lambda v, av: True),
+        })
+
+    classes = [make_class(index) for index in range(8)]
+
+    def serialize(index):
+        obj = classes[index % 8](code='c-%d' % index, label='l-%d' % index)
+        xml = obj.xml
+        code, label = xml.find('{http://codes/%d}code' % (index % 8)), xml.find('label')
+        output = io.BytesIO()
+        write(obj, output)
+        return index, code.nsmap, dict(code.attrib), dict(label.attrib), etree.tostring(xml), output.getvalue()
+
+    expected = [serialize(index) for index in range(64)]
+    assert expected[3][1] == {'i': 'http://items/3', 'c': 'http://codes/3'}
+    assert expected[3][2] == {'index': '3'}
+    assert expected[3][3] == {}
+    assert expected[3][4] == expected[3][5]
+    assert classes[3].__dict__['code'].nsmap == {'c': 'http://codes/3'}
+    with ThreadPoolExecutor(8) as executor:
+        for _ in range(5):
+            assert list(executor.map(serialize, range(64))) == expected
+
+
+def test_xsimple_type_stores_raw_value():
+    from pysxm.ext import NoRestrictionSimpleType
+
+    class Hero(DataComplexType):
+        nsmap = {'wht': 'https://whatever/xsd'}
+        faction = XSimpleType('faction', ['red talion', 'black zero'], lambda v, av: v in av,
+                              tagname='group', nsmap={'wht': 'https://whatever/xsd'},
+                              attrib={'list': 'red talion, the hippies'})
+        level = XSimpleType('level', None, lambda v, av: True)
+
+    hero = Hero(nickname='Nick', faction='red talion', level=3)
+    assert hero.__dict__ == {'nickname': 'Nick', 'faction': 'red talion', 'level': 3}
+    faction = hero.faction
+    assert isinstance(faction, NoRestrictionSimpleType)
+    assert (faction.value, faction.tagname, faction.attrib) == (
+        'red talion', 'group', {'list': 'red talion, the hippies'})
+    assert hero.level.nsmap is None
+    # the value read is the one of the field
+    faction.value = 'black zero'
+    assert hero.faction.value == 'black zero'
+    assert hero.__dict__['faction'] == 'black zero'
+    assert hero.xml.group == 'black zero'
+    faction.value = 'red talion'
+    xml = hero.xml
+    assert xml.group == 'red talion'
+    assert xml.group.attrib == {'list': 'red talion, the hippies'}
+    assert xml.find('level') == 3
+    hero.level = None
+    assert [child.tag for child in hero.xml.iterchildren()] == [
+        '{https://whatever/xsd}nickname', '{https://whatever/xsd}group']
+
+
+def test_record_type():
+    from lxml import etree
+    from pysxm.ext import RecordType
+    from pysxm.stream import write
+
+    class Game(RecordType):
+        nsmap = {'g': 'http://games/'}
+        _sequence = ('name', 'platform', 'released')
+        platform = ListXSimpleType(restriction=['xboxone', 'ps4'])
+        released = XDateType('released')
+
+    class RatedGame(Game):
+        rating = XSimpleType('rating', None, lambda v, av: int(v) in range(10))
+
+    assert Game.__slots__ == ('_value_platform', '_value_released', 'name')
+    assert RatedGame._sequence == ('name', 'platform', 'released', 'rating')
+    game = RatedGame(name='halo', platform='xboxone', released='2001-11-15T10:00', rating=8)
+    assert not hasattr(game, '__dict__')
+    assert game.released == '2001-11-15'
+    assert game.platform.value == 'xboxone'
+    with pytest.raises(ValueError):
+        game.platform = 'pc'
+    with pytest.raises(AttributeError):
+        game.editor = 'bungie'
+    xml = etree.tostring(game.xml)
+    assert xml == (b'<g:ratedgame xmlns:g="http://games/"><g:name>halo</g:name><platform>xboxone</platform>'
+                   b'<g:released>2001-11-15</g:released><rating>8</rating></g:ratedgame>')
+    output = io.BytesIO()
+    write(game, output)
+    assert output.getvalue() == xml
+
+    # fields not set are left out
+    assert etree.tostring(Game(name='gta').xml) == b'<g:game xmlns:g="http://games/"><g:name>gta</g:name></g:game>'
+    assert RatedGame.from_xml(xml).rating.value == '8'
+    # records have the attributes of their class
+    with pytest.raises(ValueError) as excinfo:
+        RatedGame.from_xml(xml.replace(b'<g:ratedgame ', b'<g:ratedgame id="1" '))
+    assert str(excinfo.value).startswith('<ratedgame> attributes {') and 'of RatedGame: {}' in str(excinfo.value)
+
+
+def test_restriction_facets():
+    from pysxm.ext import Restriction
+
+    codes = ['C%03d' % index for index in range(500)]
+
+    class Product(DataComplexType):
+        code = XSimpleType('code', Restriction(enumeration=codes))
+        price = XSimpleType('price', Restriction(min_exclusive=0, max_inclusive=1000, converter=float))
+        label = XSimpleType('label', Restriction(pattern='[A-Z][a-z]+', min_length=2, max_length=6))
+
+    product = Product(code='C499', price='9.99', label='Halo')
+    assert product.xml.code == 'C499'
+    assert Product.code.validate is not None
+    assert str(Product.price.restriction_values) == 'max_inclusive 1000, min_exclusive 0'
+
+    invalid = [('code', 'C500'), ('code', ['C000']), ('price', '0'), ('price', 'free'), ('price', 1000.5),
+               ('label', 'halo'), ('label', 'Halo 3'), ('label', 'Haloooo'), ('label', None)]
+    for name, value in invalid:
+        with pytest.raises(ValueError) as excinfo:
+            setattr(product, name, value)
+        assert str(excinfo.value) == 'tagname <product> value %s is invalid: expected (%s)' % (
+            value, getattr(Product, name).restriction_values)
+    assert Restriction(length=3)('abc') and not Restriction(length=3)(3)
+    # the pattern is compiled with the restriction
+    import re
+    with pytest.raises(re.error):
+        Restriction(pattern='[a-')
+
+    # a checker is still called with the restriction
+    class Tag(DataComplexType):
+        label = XSimpleType('label', Restriction(max_length=3), lambda v, av: av(v.lower()))
+
+    assert Tag.label.validate is None
+    assert Tag(label='ABC').xml.label == 'ABC'
+
+
+def test_validation_modes():
+    from pysxm.stream import write_records
+    from pysxm.validation import OFF, ValidationReport, Violation, validation
+
+    class Gamer(DataComplexType):
+        platform = ListXSimpleType(restriction=['xboxone', 'ps4'])
+
+    rows = [('a', 'xboxone', 'red'), ('b', 'pc', 'red'), ('c', 'ps4', 'pink'), ('d', 'wii', 'green')]
+
+    def gamers(rows):
+        for name, platform, color in rows:
+            yield Gamer(name=name, platform=platform, color=LightColor(color))
+
+    with validation() as report:
+        built = list(gamers(report.records(rows)))
+    assert [gamer.platform.value for gamer in built] == ['xboxone', 'pc', 'ps4', 'wii']
+    assert [error[:3] for error in report] == [
+        (1, 'gamer/platform', 'pc'), (2, 'lightcolor', 'pink'), (3, 'gamer/platform', 'wii')]
+    assert report.errors[0] == Violation(1, 'gamer/platform', 'pc', "<gamer> value (pc) not in ['xboxone', 'ps4']")
+    assert len(report.as_dicts()) == len(report) == 3
+
+    # errors are raised again out of the context or in a strict one, nothing is checked when off
+    with pytest.raises(ValueError):
+        Gamer(platform='pc')
+    with validation():
+        with pytest.raises(ValueError):
+            with validation('strict'):
+                LightColor('pink')
+        with validation(OFF) as report:
+            assert LightColor('pink').value == 'pink'
+    assert not report
+    with pytest.raises(ValueError):
+        ValidationReport('lenient')
+
+    output = io.BytesIO()
+    report = write_records(gamers(rows), output, 'gamers', validation='collect', chunk_size=2)
+    assert [(error.record, error.value) for error in report] == [(1, 'pc'), (2, 'pink'), (3, 'wii')]
+    assert output.getvalue().count(b'<gamer>') == 4
+
+
+def test_serialization_cache():
+    from lxml import etree
+    from pysxm.cache import CachedType, SerializationCache
+
+    cache = SerializationCache(max_entries=8)
+
+    class Country(CachedType, DataComplexType):
+        serialization_cache = cache
+        nsmap = {'c': 'http://countries/'}
+        _sequence = ('code', 'name', 'language')
+        language = ListXSimpleType(name='language', restriction=['fr', 'en'])
+
+    class Region(ComplexType):
+        nsmap = {'c': 'http://countries/'}
+
+        def __init__(self, name, countries):
+            self.name = name
+            self.countries = countries
+
+    class Catalog(CachedType, ComplexType):
+        serialization_cache = cache
+
+        def __init__(self, regions):
+            self.regions = regions
+
+    def country(code):
+        return Country(code=code, name='country %s' % code, language='fr')
+
+    catalog = Catalog([Region('europe', [country('fr'), country('be')]), Region('africa', [country('ci')])])
+    expected = etree.tostring(catalog.xml)
+    assert cache.stats() == dict(entries=4, max_entries=8, hits=0, misses=4, evictions=0)
+    assert etree.tostring(catalog.xml) == expected
+    assert cache.hits == 1 and len(cache.entries) == 4
+
+    # a change through a descriptor drops the path to the root, through the region which isn't cached
+    belgium = catalog.regions[0].countries[1]
+    belgium.language = 'en'
+    assert etree.tostring(catalog.xml) == expected.replace(
+        b'<c:name>country be</c:name><language>fr', b'<c:name>country be</c:name><language>en')
+    assert (cache.hits, cache.misses) == (3, 6)
+    catalog.regions[1].countries[0].name = 'ivory coast'
+    assert b'<c:name>ivory coast</c:name>' in etree.tostring(catalog.xml)
+    assert etree.tostring(catalog.xml) == etree.tostring(Catalog(catalog.regions).xml)
+
+    # objects which aren't cached have to invalidate their cached containers
+    catalog.regions[1].name = 'west africa'
+    assert b'west africa' not in etree.tostring(catalog.xml)
+    catalog.invalidate()
+    assert b'west africa' in etree.tostring(catalog.xml)
+
+    countries = [country(str(index)) for index in range(20)]
+    for item in countries:
+        item.xml
+    assert len(cache.entries) == 8 and cache.evictions == 16
+    del countries, item
+    assert not cache.entries
+    catalog.xml
+    cache.clear()
+    assert not cache.entries
+
+    # catalogs sharing their countries are tracked by concurrent threads
+    from concurrent.futures import ThreadPoolExecutor
+    shared = [country(str(index)) for index in range(4)]
+    catalogs = [Catalog([Region('region %d' % index, shared)]) for index in range(32)]
+    expected = [etree.tostring(item.xml) for item in catalogs]
+    cache.clear()
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(lambda item: etree.tostring(item.xml), catalogs)) == expected
+    shared[0].name = 'renamed'
+    assert all(b'renamed' in etree.tostring(item.xml) for item in catalogs)
+    cache.clear()
+
+    # an element which may be bound to a shadowed prefix isn't cached
+    class Label(ComplexType):
+        nsmap = {'l': 'http://countries/', 'c': 'http://labels/'}
+
+    class Sticker(CachedType, ComplexType):
+        nsmap = {'c': 'http://countries/'}
+        serialization_cache = cache
+
+    sticker = Sticker()
+    sticker.label = Label()
+    sticker.label.text = 'fragile'
+    expected = etree.tostring(sticker.xml)
+    assert etree.tostring(sticker.xml) == expected
+    assert not cache.entries
+
+
+def test_to_bytes_and_write_to(tmpdir):
+    from lxml import etree
+
+    class Gamer(DataComplexType):
+        nsmap = {'g': 'http://gamers/', 'unused': 'http://unused/'}
+        attrib = {'b': '2', 'a': '1'}
+
+    gamer = Gamer(gamertag='Lökïng', score=1)
+    assert gamer.to_bytes() == etree.tostring(gamer.xml, encoding='utf-8')
+    assert gamer.to_bytes().count(b'\n') == 0
+    assert gamer.to_bytes(encoding=None) == etree.tostring(gamer.xml)
+    assert gamer.to_bytes(xml_declaration=True).startswith(b"<?xml version='1.0' encoding='UTF-8'?>")
+    assert gamer.to_bytes(pretty_print=True) == etree.tostring(gamer.xml, encoding='utf-8', pretty_print=True)
+    assert gamer.to_bytes(encoding='iso-8859-1').decode('iso-8859-1') == gamer.to_bytes().decode('utf-8')
+    canonical = gamer.to_bytes(c14n=True)
+    assert canonical.startswith(b'<g:gamer xmlns:g="http://gamers/" a="1" b="2">')
+    assert canonical.endswith(b'<g:score>1</g:score></g:gamer>')
+    with pytest.raises(ValueError):
+        gamer.to_bytes(c14n=True, pretty_print=True)
+
+    output = io.BytesIO()
+    gamer.write_to(output, xml_declaration=True)
+    assert output.getvalue() == gamer.to_bytes(xml_declaration=True)
+    output = io.BytesIO()
+    gamer.write_to(output, exclusive=True)
+    assert output.getvalue() == gamer.to_bytes(exclusive=True) == canonical
+    filename = os.path.join(tmpdir.strpath, 'gamer.xml')
+    gamer.write_to(filename, pretty_print=True)
+    with open(filename, 'rb') as fp:
+        assert fp.read() == gamer.to_bytes(pretty_print=True)
+
+
+def test_instrumentation(tmpdir):
+    from pysxm.instrument import current_instrumentation, instrumentation
+    from pysxm.stream import write_records
+
+    class Gamer(DataComplexType):
+        platform = ListXSimpleType(restriction=['xboxone', 'ps4'])
+        birth_date = XDateType('birth_date')
+
+    records = []
+    with instrumentation(hooks=[lambda *args: records.append(args)]) as stats:
+        assert current_instrumentation() is stats
+        gamer = Gamer(gamertag='lokinghd', platform='ps4', birth_date='1990-03-21', color=LightColor('red'))
+        data = gamer.to_bytes()
+        gamer.write_to(os.path.join(tmpdir.strpath, 'gamer.xml'))
+        output = io.BytesIO()
+        write_records([gamer, gamer], output, 'gamers', compression=1)
+        # reading a field isn't a validation
+        assert gamer.platform.value == 'ps4'
+    assert current_instrumentation() is None
+    Gamer(platform='ps4')
+
+    counters = stats.as_dict()
+    assert sorted(counters) == ['build', 'dates', 'deannotate', 'serialization', 'stream', 'validation']
+    assert counters['validation']['Gamer']['calls'] == 1
+    assert counters['validation']['LightColor']['calls'] == 1
+    assert counters['dates'] == {'Gamer': dict(calls=1, seconds=counters['dates']['Gamer']['seconds'], values=1)}
+    assert counters['build']['Gamer']['calls'] == 2
+    assert counters['build']['Gamer']['elements'] == 2 * len(list(gamer.xml.iter()))
+    assert counters['serialization']['Gamer']['bytes'] == 2 * len(data)
+    assert counters['stream']['gamers']['bytes'] == len(output.getvalue())
+    assert all(stat['seconds'] >= 0 for phase in counters.values() for stat in phase.values())
+    assert len(records) == sum(stat['calls'] for phase in counters.values() for stat in phase.values())
+    assert records[0][:2] == ('validation', 'LightColor')
+    stats.reset()
+    assert stats.as_dict() == {}
+
+    # contexts of several threads overlap, left in any order
+    first, second = instrumentation(), instrumentation()
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert current_instrumentation() is second
+    second.__exit__(None, None, None)
+    assert current_instrumentation() is None
+
+
+def test_async_stream():
+    asyncio = pytest.importorskip('asyncio')
+    aio = pytest.importorskip('pysxm.aio')
+    from pysxm.stream import write_records
+    from pysxm.validation import validation
+
+    class Gamer(DataComplexType):
+        platform = ListXSimpleType(restriction=['xboxone', 'ps4'])
+
+    class Gamers(ComplexType):
+        def __init__(self, gamers):
+            self.gamers = gamers
+
+    loop = asyncio.new_event_loop()
+
+    def chunks(stream, count=None):
+        result = []
+        while count is None or len(result) < count:
+            try:
+                result.append(loop.run_until_complete(stream.__anext__()))
+            except StopAsyncIteration:  # noqa: F821
+                break
+        return result
+
+    gamers = Gamers([Gamer(gamertag='gamer%d' % index, platform='ps4') for index in range(500)])
+    try:
+        result = chunks(aio.stream(gamers, buffer_size=512, max_pending=2))
+        assert len(result) > 5
+        assert b''.join(result) == gamers.to_bytes()
+
+        output = io.BytesIO()
+        write_records(gamers.gamers, output, 'gamers', compression=1)
+        result = chunks(aio.stream_records(iter(gamers.gamers), 'gamers', compression=1))
+        assert b''.join(result) == output.getvalue()
+
+        # the writer stops once the stream is closed
+        stream = aio.stream(gamers, buffer_size=64, max_pending=1)
+        assert len(chunks(stream, 2)) == 2
+        loop.run_until_complete(stream.aclose())
+        assert stream.future.done() and chunks(stream) == []
+
+        def failing():
+            yield gamers.gamers[0]
+            raise RuntimeError('connection lost')
+
+        with pytest.raises(RuntimeError):
+            chunks(aio.stream_records(failing(), 'gamers'))
+
+        # records built by the executor are checked in the validation context of the stream
+        with validation() as report:
+            stream = aio.stream_records((Gamer(platform=platform) for platform in ('ps4', 'wii')), 'gamers')
+        assert b'wii' in b''.join(chunks(stream))
+        assert [error.value for error in report] == ['wii']
+    finally:
+        loop.close()
+
+
+def test_generated_classes():
+    import datetime
+    import types
+    from decimal import Decimal
+    from lxml import etree
+    from pysxm.codegen import generate
+
+    path = os.path.join(os.path.dirname(__file__), 'schemas', 'purchase_order.xsd')
+    code = generate(path)
+    module = types.ModuleType('purchase_order')
+    exec(compile(code, path, 'exec'), module.__dict__)
+    assert "STATUS = Restriction(enumeration=('open', 'shipped', 'closed'))" in code
+    assert 'ITEM_QUANTITY = Restriction(min_inclusive=1, max_exclusive=100, converter=int)' in code
+    assert module.Item._sequence == ('productName', 'quantity', 'USPrice', 'comment', 'shipDate', 'class_')
+    assert module.PurchaseOrder.nsmap == {'po': 'http://purchases/'}
+    assert issubclass(module.ShipTo, module.USAddress) and module.ShipTo.tagname == 'shipTo'
+
+    address = dict(name='Alice Smith', street='123 Maple Street', city='Mill Valley', state='CA', zip=Decimal('90952'))
+    order = module.PurchaseOrder(
+        shipTo=module.ShipTo(**address), billTo=module.BillTo(**address), comment='Hurry', status='open',
+        items=[module.Item(attrib={'partNum': '872-AA'}, productName='Lawnmower', quantity=1,
+                           USPrice=Decimal('148.95'), shipDate=datetime.date(1999, 5, 21)),
+               module.Item(attrib={'partNum': '926-AA'}, productName='Monitor', quantity=3,
+                           USPrice=Decimal('39.98'), class_='A')])
+    schema = etree.XMLSchema(etree.parse(path))
+    schema.assertValid(order.xml)
+    assert module.PurchaseOrder.from_xml(order.to_bytes()).to_bytes() == order.to_bytes()
+
+    for klass, values in [(module.PurchaseOrder, dict(status='lost')), (module.Item, dict(quantity=100)),
+                          (module.ShipTo, dict(state='ca')), (module.Item, dict(shipDate='soon'))]:
+        with pytest.raises(ValueError):
+            klass(**values)
+    assert module.Items._types == {'item': [module.Item]}
+    assert '\n\n\n# classes of the fields' in code
+
+    # recursive and repeated types
+    schema = io.BytesIO(b"""<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:t="http://tree/"
+        targetNamespace="http://tree/" elementFormDefault="qualified">
+      <xs:element name="node" type="t:Node"/>
+      <xs:complexType name="Node">
+        <xs:sequence>
+          <xs:element name="label" type="xs:string"/>
+          <xs:element name="node" type="t:Node" minOccurs="0"/>
+          <xs:element name="tag" type="xs:int" minOccurs="0" maxOccurs="unbounded"/>
+        </xs:sequence>
+      </xs:complexType>
+    </xs:schema>""")
+    module = types.ModuleType('tree')
+    exec(compile(generate(schema), 'tree', 'exec'), module.__dict__)
+    assert module.Node._types == {'node': module.Node, 'tag': [module.Tag]}
+    node = module.Node(label='root', node=module.Node(label='leaf'), tag=[module.Tag(1), module.Tag(2)])
+    assert module.Node.from_xml(node.to_bytes()).to_bytes() == node.to_bytes()
+
+
+def test_schema_validation(tmpdir):
+    from lxml import etree
+    from pysxm.schema import SchemaCache, SchemaValidator
+    from pysxm.validation import OFF, validation
+
+    path = os.path.join(tmpdir.strpath, 'score.xsd')
+    schema = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+      <xs:element name="score"><xs:complexType><xs:sequence>
+        <xs:element name="gamer" type="xs:string"/><xs:element name="points" type="xs:%s"/>
+      </xs:sequence></xs:complexType></xs:element></xs:schema>'''
+    with open(path, 'w') as fp:
+        fp.write(schema % 'int')
+    cache = SchemaCache()
+
+    class Score(DataComplexType):
+        _sequence = ('gamer', 'points')
+        xml_schema = SchemaValidator(path, cache=cache)
+
+    class SampledScore(Score):
+        _tagname = 'score'
+        xml_schema = SchemaValidator(path, sample=3, cache=cache)
+
+    assert Score(gamer='lokinghd', points=12).to_bytes() == b'<score><gamer>lokinghd</gamer><points>12</points></score>'
+    with pytest.raises(etree.DocumentInvalid):
+        Score(gamer='lokinghd', points='many').xml
+    with pytest.raises(etree.DocumentInvalid):
+        Score(points=1).save(os.path.join(tmpdir.strpath, 'score.xml'))
+    assert cache.compilations == 1
+    # validators of a file share its schema and the lock of its validations
+    assert Score.xml_schema.locked() == SampledScore.xml_schema.locked()
+
+    invalid = SampledScore(gamer='lokinghd', points=1.5)
+    with pytest.raises(etree.DocumentInvalid):
+        invalid.xml
+    invalid.xml
+    invalid.xml
+    with pytest.raises(etree.DocumentInvalid):
+        invalid.to_bytes()
+    assert cache.compilations == 1
+
+    # the schema is compiled again once its file changes
+    with open(path, 'w') as fp:
+        fp.write(schema % 'decimal')
+    os.utime(path, (os.stat(path).st_atime, os.stat(path).st_mtime + 10))
+    Score(gamer='lokinghd', points=1.5).xml
+    assert cache.compilations == 2
+
+    with validation() as report:
+        Score(gamer='lokinghd', points='many').xml
+        with validation(OFF):
+            Score(gamer='lokinghd', points='many').xml
+    assert [(error.path, 'points' in error.message) for error in report] == [('score', True)]
+
+
+def test_append_writer(tmpdir):
+    from lxml import etree
+    from pysxm.stream import AppendWriter, write_records
+
+    class Event(DataComplexType):
+        nsmap = {'e': 'http://events/'}
+        _sequence = ('name', 'level')
+
+    path = os.path.join(tmpdir.strpath, 'events.xml')
+    events = [Event(name='event %d' % index, level=index) for index in range(4)]
+    with AppendWriter(path, 'events', nsmap=Event.nsmap) as writer:
+        writer.append(events[0])
+        writer.append(Event())
+    with AppendWriter(path, 'events', nsmap=Event.nsmap, fsync=True) as writer:
+        assert writer.recovered == 0
+        writer.extend(events[1:])
+    output = io.BytesIO()
+    write_records(events, output, 'events', nsmap=Event.nsmap)
+    with open(path, 'rb') as fp:
+        document = fp.read()
+    assert document == output.getvalue()
+
+    # a document whose end was lost is cut after its last complete record
+    with open(path, 'wb') as fp:
+        fp.write(document[:-30])
+    with AppendWriter(path, 'events', nsmap=Event.nsmap) as writer:
+        assert writer.recovered == len(document[:-30]) - document.rindex(b'<e:event>')
+        writer.append(events[3])
+    with open(path, 'rb') as fp:
+        assert fp.read() == document
+
+    with open(path, 'wb') as fp:
+        fp.write(b'<events/>\n')
+    with AppendWriter(path, 'events') as writer:
+        writer.append(events[0])
+    with open(path, 'rb') as fp:
+        assert etree.fromstring(fp.read())[0].tag == '{http://events/}event'
+
+    with open(path, 'wb') as fp:
+        fp.write(b'<events xmlns:e="http:')
+    with pytest.raises(ValueError):
+        AppendWriter(path, 'events')